@@ -1,10 +1,9 @@
 import logging
+import logging.handlers
 import os
 import sys
 import json
-import tkinter as tk
-from tkinter import ttk, messagebox
-from contextlib import redirect_stdout
+from contextlib import redirect_stdout, contextmanager, asynccontextmanager
 from io import StringIO
 from selenium import webdriver
 from selenium.webdriver.chrome.service import Service
@@ -18,13 +17,45 @@ from selenium.webdriver.support import expected_conditions as EC
 from selenium.common.exceptions import TimeoutException, WebDriverException, InvalidSessionIdException, NoSuchWindowException
 import time
 import random
-from urllib3.util.retry import Retry
 from requests.adapters import HTTPAdapter
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
 import threading
 import webbrowser
 import subprocess
 import math
-import re
+import queue
+import collections
+import argparse
+import concurrent.futures
+import asyncio
+import urllib.parse
+import tempfile
+import sqlite3
+import html
+import tracemalloc
+try:
+    import lxml.html
+except ImportError:
+    lxml = None
+try:
+    import httpx
+except ImportError:
+    httpx = None
+try:
+    import h2
+except ImportError:
+    h2 = None
+try:
+    import tkinter as tk
+    from tkinter import ttk, messagebox
+except ImportError:
+    # Servers without Tk (e.g. python:*-slim images) can still run the command-line batch mode; only the GUI needs it.
+    tk = ttk = messagebox = None
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+    import msvcrt
 
 # Version constant
 VERSION = "1.05"
@@ -32,15 +63,22 @@ VERSION = "1.05"
 # Suppress WebDriver Manager logs
 os.environ['WDM_LOG'] = '0'
 
-# Suppress urllib3 logs
+# Suppress urllib3 and httpx logs
 logging.getLogger("urllib3").setLevel(logging.WARNING)
-
-# Set up logging
+logging.getLogger("httpx").setLevel(logging.WARNING)
+
+# Set up logging; output.log rolls over to output.log.1 ... .3 at 5 MB
+LOG_FILE = "output.log"
+LOG_MAX_BYTES = 5 * 1024 * 1024
+LOG_BACKUP_COUNT = 3
+# The log window shows the last LOG_MAX_LINES lines and is refreshed every LOG_FLUSH_MS
+LOG_MAX_LINES = 2000
+LOG_FLUSH_MS = 100
 logging.basicConfig(
     level=logging.INFO,
     format='%(message)s',
     handlers=[
-        logging.FileHandler("output.log", mode='a'),
+        logging.handlers.RotatingFileHandler(LOG_FILE, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUP_COUNT),
         logging.StreamHandler(sys.stdout)
     ]
 )
@@ -48,14 +86,186 @@ logger = logging.getLogger()
 
 # Global variables
 TIMEOUT = 20
+DOWNLOAD_WORKERS = 4
+DOWNLOAD_QUEUE_SIZE = 32
+BROWSER_INSTANCES = 1
+MAX_REQUEUES = 2
+LISTING_READAHEAD = 2
+ENUMERATE_CONCURRENCY = 4
+ADAPTIVE_CONCURRENCY = True
+MIN_CONCURRENCY = 1
+LATENCY_TOLERANCE = 2.5
+BACKOFF_COOLDOWN = 2.0
+# Host-wide budget shared by every get_pixiv process started from the same working directory; 0 disables a budget.
+# Both are off by default and set per run from the Options frame or --rate-limit / --byte-limit.
+RATE_LIMIT_FILE = "pixiv_rate_limit.json"
+RATE_LIMIT_REQUESTS = 0
+RATE_LIMIT_BYTES = 0
+RATE_LIMIT_BURST = 2.0
+RETRY_ATTEMPTS = 4
+RETRY_BASE_DELAY = 1.0
+RETRY_MAX_DELAY = 30.0
+RETRY_BUDGET_RATIO = 0.2
+RETRY_BUDGET_MIN = 10
+BREAKER_WINDOW = 20
+BREAKER_FAILURE_RATE = 0.5
+BREAKER_COOLDOWN = 30.0
+# Optional asyncio transport (needs httpx): image and API requests run as tasks on one event loop thread.
+ASYNC_TRANSPORT = False
+ASYNC_CONNECTIONS_PER_HOST = 16
+ASYNC_MAX_IN_FLIGHT = 64
+# HTTP/2 multiplexes the image requests over a few connections to i.pximg.net instead of one per download.
+HTTP2_IMAGES = False
+HTTP2_CONNECTIONS = 2
+BENCHMARK_REQUESTS = 200
+# Requests dropped by the automation browser in lean mode; page counts and URLs come from the HTML and preload data.
+LEAN_BLOCKED_URLS = ["*.jpg*", "*.jpeg*", "*.png*", "*.gif*", "*.webp*", "*.svg*", "*.ico*",
+                     "*.woff*", "*.ttf*", "*.otf*", "*.mp4*", "*.webm*", "*.mp3*", "*.m4a*"]
+LEAN_BLOCKED_SCRIPTS = ["*googletagmanager.com/*", "*google-analytics.com/*", "*doubleclick.net/*",
+                        "*googlesyndication.com/*", "*amazon-adsystem.com/*", "*ads-pixiv.net/*"]
+BLOCK_THIRD_PARTY_SCRIPTS = True
+READY_TIMEOUT = 5
+LISTING_SETTLE_TIME = 0.5
+# An artwork page is ready once the original image URL is in the DOM and, for multi-page works, the "1/N" counter is rendered.
+ARTWORK_READY_JS = """
+const original = document.querySelector("a[href*='/img-original/']") || document.getElementById("meta-preload-data");
+const preview = document.querySelector("div[aria-label='Preview'], div[aria-label='プレビュー']");
+return Boolean(original) && (!preview || Array.from(preview.querySelectorAll("span")).some(span => span.textContent.includes("/")));
+"""
+PAGE_LOAD_STATS_JS = """
+const nav = performance.getEntriesByType('navigation')[0];
+const bytes = performance.getEntriesByType('resource').reduce((total, r) => total + (r.transferSize || 0), nav ? nav.transferSize : 0);
+return [bytes, nav && nav.loadEventEnd > 0 ? nav.duration : performance.now()];
+"""
+ARTWORKS_PER_PAGE = 48
+CHUNK_SIZE = 64 * 1024
+API_BASE = "https://www.pixiv.net"
 COOKIE_FILE = "pixiv_cookies.json"
 save_folder_base = "pixiv_images"
+INDEX_FILE = os.path.join(save_folder_base, "download_index.db")
+LISTING_CACHE_FILE = os.path.join(save_folder_base, "listing_cache.json")
+LISTING_CACHE_TTL = 60 * 60
+FAILURES_FILE = "failed.json"
+CHECKPOINT_FILE = "checkpoint.json"
+CHECKPOINT_INTERVAL = 10
 headers = {
     "Referer": "https://www.pixiv.net/",
     "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/122.0.0.0 Safari/537.36",
 }
 
-class CustomDialog(tk.Toplevel):
+# Artwork page extraction: targeted regex / preload JSON by default, BeautifulSoup kept as the reference path.
+EXTRACTOR_BACKEND = "regex"
+ARTWORK_LINK_RE = re.compile(r"""href=["'][^"'>]*/artworks/(\d+)["']""")
+ORIGINAL_URL_RE = re.compile(r"https://i\.pximg\.net/img-original/img/\d{4}/\d{2}/\d{2}/\d{2}/\d{2}/\d{2}/(\d+_p\d+\.(png|jpg|jpeg|gif))")
+PRELOAD_DATA_RE = re.compile(r"""id=["']meta-preload-data["'][^>]*?content=(["'])(.*?)\1""", re.S)
+PREVIEW_DIV_RE = re.compile(r"""aria-label=["'](?:Preview|プレビュー)["']""")
+PAGE_COUNTER_RE = re.compile(r">\s*\d+\s*/\s*(\d+)\s*<")
+OG_IMAGE_RE = re.compile(r"""<meta\b[^>]*\bproperty=["']og:image["'][^>]*>""")
+DATE_PATH_RE = re.compile(r"img/(\d{4}/\d{2}/\d{2}/\d{2}/\d{2}/\d{2})")
+IMAGE_EXTENSIONS = ("png", "jpg", "gif")
+IMAGE_SIGNATURES = {b"\x89PNG\r\n\x1a\n": "png", b"\xff\xd8\xff": "jpg", b"GIF87a": "gif", b"GIF89a": "gif"}
+
+def sniff_image(data):
+    for signature, ext in IMAGE_SIGNATURES.items():
+        if data.startswith(signature):
+            return ext
+    return None
+
+def extract_artwork_ids(page_source, backend=EXTRACTOR_BACKEND):
+    # Artwork IDs linked from a listing page, in page order without duplicates.
+    if backend == "bs4":
+        soup = BeautifulSoup(page_source, "html.parser")
+        hrefs = [link["href"] for link in soup.find_all("a", href=re.compile(r"(/en)?/artworks/\d+$"))]
+        return list(dict.fromkeys(re.search(r"/artworks/(\d+)$", href).group(1) for href in hrefs))
+    if backend == "lxml" and lxml:
+        hrefs = lxml.html.fromstring(page_source).xpath("//a/@href")
+        return list(dict.fromkeys(match.group(1) for href in hrefs if (match := re.search(r"/artworks/(\d+)$", href))))
+    return list(dict.fromkeys(ARTWORK_LINK_RE.findall(page_source)))
+
+def extract_artwork(page_source, artwork_id, backend=EXTRACTOR_BACKEND):
+    # Returns (base_url, ext, page_count, page_count_found) for an artwork page, or None if no image URL is present.
+    if backend == "bs4":
+        return _extract_artwork_bs4(page_source, artwork_id)
+    if backend == "lxml" and lxml:
+        return _extract_artwork_lxml(page_source, artwork_id)
+    return _extract_artwork_regex(page_source, artwork_id)
+
+def _build_artwork(page_source, artwork_id, page_count, og_image):
+    if img_match := ORIGINAL_URL_RE.search(page_source):
+        return img_match.group(0).rsplit("_p", 1)[0], img_match.group(2), page_count or 1, page_count is not None
+    if og_image and "i.pximg.net" in og_image and (date_match := DATE_PATH_RE.search(og_image)):
+        return f"https://i.pximg.net/img-original/img/{date_match.group(1)}/{artwork_id}", "png", page_count or 1, page_count is not None
+    return None
+
+def _extract_artwork_regex(page_source, artwork_id):
+    if preload := PRELOAD_DATA_RE.search(page_source):
+        try:
+            illust = json.loads(html.unescape(preload.group(2)))["illust"][str(artwork_id)]
+            if original := illust["urls"]["original"]:
+                base_url, ext = original.rsplit(".", 1)
+                return base_url.rsplit("_p", 1)[0], ext, int(illust["pageCount"]), True
+        except (ValueError, KeyError, TypeError):
+            pass
+    page_count = None
+    if preview := PREVIEW_DIV_RE.search(page_source):
+        if counter := PAGE_COUNTER_RE.search(page_source, preview.end(), preview.end() + 5000):
+            page_count = int(counter.group(1))
+    og_image = None
+    if og_tag := OG_IMAGE_RE.search(page_source):
+        if content := re.search(r"""content=["']([^"']+)""", og_tag.group(0)):
+            og_image = content.group(1)
+    return _build_artwork(page_source, artwork_id, page_count, og_image)
+
+def _extract_artwork_bs4(page_source, artwork_id):
+    soup = BeautifulSoup(page_source, "html.parser")
+    page_count = None
+    if preview_div := soup.find("div", {"aria-label": ["Preview", "プレビュー"]}):
+        for span in preview_div.find_all("span"):
+            if "/" in span.text:
+                page_count = int(span.text.split("/")[1])
+                break
+    meta_tag = soup.find("meta", property="og:image")
+    return _build_artwork(page_source, artwork_id, page_count, meta_tag["content"] if meta_tag else None)
+
+def _extract_artwork_lxml(page_source, artwork_id):
+    tree = lxml.html.fromstring(page_source)
+    page_count = None
+    for text in tree.xpath("//div[@aria-label='Preview' or @aria-label='プレビュー']//span/text()"):
+        if "/" in text:
+            page_count = int(text.split("/")[1])
+            break
+    og_image = tree.xpath("//meta[@property='og:image']/@content")
+    return _build_artwork(page_source, artwork_id, page_count, og_image[0] if og_image else None)
+
+def benchmark_extractors(paths, repeat=5):
+    # Parse time and peak traced memory per saved page for each extraction backend.
+    backends = ["bs4", "regex"] + (["lxml"] if lxml else [])
+    results = {backend: [] for backend in backends}
+    for path in paths:
+        with open(path, encoding="utf-8") as f:
+            page_source = f.read()
+        id_match = re.search(r"/artworks/(\d+)", page_source) or re.search(r"(\d+)", os.path.basename(path))
+        artwork_id = id_match.group(1) if id_match else "0"
+        for backend in backends:
+            start = time.perf_counter()
+            for _ in range(repeat):
+                extract_artwork(page_source, artwork_id, backend)
+                extract_artwork_ids(page_source, backend)
+            elapsed_ms = (time.perf_counter() - start) / repeat * 1000
+            tracemalloc.start()
+            extract_artwork(page_source, artwork_id, backend)
+            extract_artwork_ids(page_source, backend)
+            peak_kb = tracemalloc.get_traced_memory()[1] / 1024
+            tracemalloc.stop()
+            results[backend].append((elapsed_ms, peak_kb))
+            logger.info(f"{os.path.basename(path)} ({len(page_source) / 1024:.0f} KB) [{backend}]: {elapsed_ms:.2f} ms, peak {peak_kb:.0f} KB")
+    for backend, samples in results.items():
+        if samples:
+            logger.info(f"[{backend}] avg {sum(ms for ms, _ in samples) / len(samples):.2f} ms, "
+                        f"avg peak {sum(kb for _, kb in samples) / len(samples):.0f} KB over {len(samples)} pages")
+    return results
+
+class CustomDialog(tk.Toplevel if tk else object):
     def __init__(self, parent, title, message, buttons=None, link=None):
         super().__init__(parent)
         self.parent = parent
@@ -87,24 +297,2139 @@ class CustomDialog(tk.Toplevel):
     def on_close(self):
         self.destroy()
 
-class PixivDownloaderApp:
-    def __init__(self, root):
-        self.root = root
-        self.root.title(f"get pixiv")
+class DownloadPool:
+    # Image URLs are pushed onto a bounded queue by the browser thread and drained by worker threads.
+    def __init__(self, download_image, on_artwork_done, workers=DOWNLOAD_WORKERS, queue_size=DOWNLOAD_QUEUE_SIZE):
+        self.download_image = download_image
+        self.on_artwork_done = on_artwork_done
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.lock = threading.Lock()
+        self.pending = {}
+        self.failed_downloads = []
+        self.threads = [threading.Thread(target=self._worker, daemon=True) for _ in range(max(1, workers))]
+        for thread in self.threads:
+            thread.start()
+
+    def submit(self, artwork_url, page_num, image_urls):
+        with self.lock:
+            self.pending[artwork_url] = [len(image_urls), []]
+        for image_url in image_urls:
+            self.queue.put((artwork_url, page_num, image_url))
+
+    def skip(self, artwork_url, page_num):
+        with self.lock:
+            self.on_artwork_done(artwork_url, page_num, ["skipped"])
+
+    def close(self):
+        for _ in self.threads:
+            self.queue.put(None)
+        for thread in self.threads:
+            thread.join()
+
+    def _worker(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            artwork_url, page_num, image_url = item
+            try:
+                status = self.download_image(image_url)
+            except Exception as e:
+                self.failed_downloads.append((image_url, artwork_url, page_num, str(e)))
+                status = "failed"
+            self.record(artwork_url, page_num, status)
+
+    def record(self, artwork_url, page_num, status):
+        with self.lock:
+            entry = self.pending[artwork_url]
+            entry[0] -= 1
+            entry[1].append(status)
+            if entry[0] == 0:
+                del self.pending[artwork_url]
+                self.on_artwork_done(artwork_url, page_num, entry[1])
+
+class AsyncDownloadPool(DownloadPool):
+    # DownloadPool on the asyncio transport: every image is a task on the event loop instead of an item for a worker
+    # thread. The submitting thread blocks once max_in_flight images are pending, like it does on a full queue.
+    def __init__(self, transport, download_image, on_artwork_done, max_in_flight=ASYNC_MAX_IN_FLIGHT):
+        self.transport = transport
+        self.download_image = download_image
+        self.on_artwork_done = on_artwork_done
+        self.slots = threading.BoundedSemaphore(max(1, max_in_flight))
+        self.lock = threading.Lock()
+        self.idle = threading.Condition(self.lock)
+        self.pending = {}
+        self.failed_downloads = []
+        self.futures = set()
+        # Done callbacks fire on the event-loop thread; accounting (checkpoint saves, logging, listeners) runs here instead.
+        self.recorder = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix="download-record")
+
+    def submit(self, artwork_url, page_num, image_urls):
+        with self.lock:
+            self.pending[artwork_url] = [len(image_urls), []]
+        for image_url in image_urls:
+            self.slots.acquire()
+            future = self.transport.submit(self.download_image(image_url))
+            with self.lock:
+                self.futures.add(future)
+            future.add_done_callback(lambda future, image_url=image_url: self._done(future, artwork_url, page_num, image_url))
+
+    def close(self):
+        with self.idle:
+            self.idle.wait_for(lambda: not self.futures)
+        self.recorder.shutdown()
+
+    def _done(self, future, artwork_url, page_num, image_url):
+        self.slots.release()
+        self.recorder.submit(self._record, future, artwork_url, page_num, image_url)
+
+    def _record(self, future, artwork_url, page_num, image_url):
+        # A task cancelled by Stop before it ever ran has no finally block to rely on, so accounting happens here.
+        try:
+            if future.cancelled():
+                status = "stopped"
+            elif error := future.exception():
+                self.failed_downloads.append((image_url, artwork_url, page_num, str(error)))
+                status = "failed"
+            else:
+                status = future.result()
+            self.record(artwork_url, page_num, status)
+        finally:
+            with self.idle:
+                self.futures.discard(future)
+                self.idle.notify_all()
+
+class ConcurrencyController:
+    # AIMD limit on in-flight HTTP requests: +1 after a full window of healthy responses, halved on 429/5xx, errors or a latency blow-up.
+    def __init__(self, max_limit, min_limit=MIN_CONCURRENCY, on_change=None):
+        self.min_limit = max(1, min_limit)
+        self.max_limit = max(self.min_limit, max_limit)
+        self.limit = max(self.min_limit, self.max_limit // 2)
+        self.on_change = on_change
+        self.condition = threading.Condition()
+        self.waiters = []
+        self.in_flight = 0
+        self.successes = 0
+        self.latency = None
+        self.best_latency = None
+        self.throughput = 0.0
+        self.last_decrease = 0.0
+        self.requests = 0
+        self.throttled = 0
+        self.errors = 0
+
+    def acquire(self, should_stop=lambda: False):
+        with self.condition:
+            while self.in_flight >= self.limit:
+                if should_stop():
+                    return False
+                self.condition.wait(0.5)
+            self.in_flight += 1
+            return True
+
+    async def acquire_async(self):
+        # acquire() for tasks on an event loop: a full controller parks a future that release() resolves on its loop.
+        loop = asyncio.get_running_loop()
+        while True:
+            with self.condition:
+                if self.in_flight < self.limit:
+                    self.in_flight += 1
+                    return
+                waiter = loop.create_future()
+                self.waiters.append((loop, waiter))
+            await waiter
+
+    def _wake_waiters(self):
+        for loop, waiter in self.waiters:
+            if not loop.is_closed():
+                loop.call_soon_threadsafe(lambda waiter=waiter: waiter.done() or waiter.set_result(None))
+        self.waiters.clear()
+
+    def release(self, status=None, latency=None, error=None):
+        # status is the HTTP status code, latency the time to response headers; error is set when no response arrived.
+        with self.condition:
+            self.in_flight -= 1
+            self.requests += 1
+            if error:
+                self.errors += 1
+                self._decrease(error)
+            elif status == 429 or (status or 0) >= 500:
+                self.throttled += 1
+                self._decrease(f"HTTP {status}")
+            elif latency is not None:
+                self._observe(latency)
+            self.condition.notify_all()
+            self._wake_waiters()
+
+    def record_transfer(self, size, seconds):
+        if seconds > 0:
+            with self.condition:
+                rate = size / seconds
+                self.throughput = rate if not self.throughput else 0.8 * self.throughput + 0.2 * rate
+
+    def _observe(self, latency):
+        self.latency = latency if self.latency is None else 0.8 * self.latency + 0.2 * latency
+        self.best_latency = latency if self.best_latency is None else min(self.best_latency, latency)
+        if self.latency > self.best_latency * LATENCY_TOLERANCE and self.latency - self.best_latency > 0.2:
+            self._decrease(f"latency {self.latency * 1000:.0f} ms")
+            return
+        self.successes += 1
+        if self.successes >= self.limit:
+            self.successes = 0
+            if self.limit < self.max_limit:
+                self.limit += 1
+                self._changed(self.limit - 1, "healthy")
+
+    def _decrease(self, reason):
+        # One halving per cooldown, so a burst of 429s from requests already in flight doesn't collapse the limit to the floor.
+        now = time.time()
+        if now - self.last_decrease < BACKOFF_COOLDOWN:
+            return
+        self.last_decrease = now
+        self.successes = 0
+        self.latency = None
+        previous = self.limit
+        self.limit = max(self.min_limit, self.limit // 2)
+        if self.limit != previous:
+            self._changed(previous, reason)
+
+    def _changed(self, previous, reason):
+        if self.on_change:
+            self.on_change(previous, self.limit, reason)
+
+    def state(self):
+        latency = f"{self.latency * 1000:.0f} ms" if self.latency is not None else "-"
+        return f"{self.limit}/{self.max_limit} in flight, {latency}, {self.throughput / 1024:.0f} KB/s"
+
+@contextmanager
+def file_lock(path):
+    # Exclusive lock on path + ".lock", shared by every instance that reads and rewrites the same state file.
+    with open(path + ".lock", "a+") as lock_file:
+        if fcntl:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+        else:
+            lock_file.seek(0)
+            msvcrt.locking(lock_file.fileno(), msvcrt.LK_LOCK, 1)
+        try:
+            yield
+        finally:
+            if fcntl:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+            else:
+                lock_file.seek(0)
+                msvcrt.locking(lock_file.fileno(), msvcrt.LK_UNLCK, 1)
+
+class SharedRateLimiter:
+    # Request and byte token buckets kept in a locked file, so all instances draw from one budget instead of each throttling alone.
+    # Takes may overdraw a bucket; the caller then sleeps off the debt, which keeps every take to a single lock round trip.
+    def __init__(self, path=RATE_LIMIT_FILE, requests_per_sec=RATE_LIMIT_REQUESTS, bytes_per_sec=RATE_LIMIT_BYTES, burst=RATE_LIMIT_BURST):
+        self.path = path
+        self.requests_per_sec = requests_per_sec
+        self.bytes_per_sec = bytes_per_sec
+        self.burst = burst
+        self.waited = 0.0
+
+    @property
+    def enabled(self):
+        return self.requests_per_sec > 0 or self.bytes_per_sec > 0
+
+    def take(self, requests=0, size=0, should_stop=lambda: False):
+        return RetryPolicy.sleep(self.reserve(requests, size), should_stop)
+
+    def reserve(self, requests=0, size=0):
+        # Draw from the buckets and return the debt in seconds; take() sleeps it off, the async transport awaits it.
+        budgets = [(name, amount, rate) for name, amount, rate in (("requests", requests, self.requests_per_sec), ("bytes", size, self.bytes_per_sec))
+                   if amount and rate > 0]
+        if not budgets:
+            return 0.0
+        with self._locked():
+            state = self._read()
+            now = time.time()
+            delay = 0.0
+            for name, amount, rate in budgets:
+                capacity = rate * self.burst
+                bucket = state.get(name) or {"tokens": capacity, "updated": now}
+                tokens = min(capacity, bucket["tokens"] + (now - bucket["updated"]) * rate) - amount
+                state[name] = {"tokens": tokens, "updated": now}
+                delay = max(delay, -tokens / rate)
+            self._write(state)
+        self.waited += delay
+        return delay
+
+    def _locked(self):
+        return file_lock(self.path)
+
+    def _read(self):
+        try:
+            with open(self.path, "r") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _write(self, state):
+        with open(self.path, "w") as f:
+            json.dump(state, f)
+
+class RetryPolicy:
+    # The single retry layer for image, API and browser requests: capped exponential backoff with full jitter,
+    # a per-run retry budget, and a circuit breaker that pauses every worker when recent failures spike.
+    def __init__(self, attempts=RETRY_ATTEMPTS, base_delay=RETRY_BASE_DELAY, max_delay=RETRY_MAX_DELAY,
+                 budget_ratio=RETRY_BUDGET_RATIO, budget_min=RETRY_BUDGET_MIN):
+        self.attempts = attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.budget_ratio = budget_ratio
+        self.budget_min = budget_min
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.requests = 0
+            self.retries = 0
+            self.budget_exhausted = False
+            self.outcomes = collections.deque(maxlen=BREAKER_WINDOW)
+            self.open_until = 0.0
+            self.trips = 0
+
+    def call(self, attempt_fn, description, should_stop=lambda: False, retry_on=(OSError,), is_retryable=None):
+        is_retryable = is_retryable or self.is_retryable
+        for attempt in range(1, self.attempts + 1):
+            self.wait_closed(should_stop)
+            try:
+                result = attempt_fn()
+            except retry_on as e:
+                self.record(False)
+                if attempt == self.attempts or should_stop() or not is_retryable(e) or not self.spend_retry():
+                    raise
+                delay = self.backoff(attempt)
+                logger.info(f"Retrying {description} in {delay:.1f}s (attempt {attempt + 1}/{self.attempts}): {str(e)}")
+                if not self.sleep(delay, should_stop):
+                    raise
+                continue
+            self.record(True)
+            return result
+
+    async def call_async(self, attempt_fn, description, retry_on=(OSError,), is_retryable=None):
+        # call() for coroutines on the async transport: backoff and an open circuit are awaited, so a waiting retry
+        # holds no thread, and Stop cancels the task instead of being polled.
+        is_retryable = is_retryable or self.is_retryable
+        for attempt in range(1, self.attempts + 1):
+            await asyncio.sleep(self.closed_in())
+            try:
+                result = await attempt_fn()
+            except retry_on as e:
+                self.record(False)
+                if attempt == self.attempts or not is_retryable(e) or not self.spend_retry():
+                    raise
+                delay = self.backoff(attempt)
+                logger.info(f"Retrying {description} in {delay:.1f}s (attempt {attempt + 1}/{self.attempts}): {str(e)}")
+                await asyncio.sleep(delay)
+                continue
+            self.record(True)
+            return result
+
+    def backoff(self, attempt):
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+
+    @staticmethod
+    def is_retryable(error):
+        # A 4xx other than 429 won't change on retry.
+        response = getattr(error, "response", None)
+        return response is None or response.status_code == 429 or response.status_code >= 500
+
+    def spend_retry(self):
+        with self.lock:
+            if self.retries >= max(self.budget_min, self.requests * self.budget_ratio):
+                if not self.budget_exhausted:
+                    self.budget_exhausted = True
+                    logger.info(f"Retry budget exhausted ({self.retries} retries for {self.requests} requests), failing fast.")
+                return False
+            self.retries += 1
+            return True
+
+    def record(self, success):
+        with self.lock:
+            self.requests += 1
+            self.outcomes.append(success)
+            failures = self.outcomes.count(False)
+            if len(self.outcomes) == self.outcomes.maxlen and failures >= BREAKER_FAILURE_RATE * len(self.outcomes) and time.time() >= self.open_until:
+                self.open_until = time.time() + BREAKER_COOLDOWN
+                self.trips += 1
+                self.outcomes.clear()
+                logger.info(f"Circuit open: {failures}/{BREAKER_WINDOW} recent requests failed, pausing for {BREAKER_COOLDOWN:.0f}s.")
+
+    def wait_closed(self, should_stop):
+        if delay := self.closed_in():
+            self.sleep(delay, should_stop)
+
+    def closed_in(self):
+        with self.lock:
+            return max(0.0, self.open_until - time.time())
+
+    @staticmethod
+    def sleep(delay, should_stop):
+        deadline = time.time() + delay
+        while (remaining := deadline - time.time()) > 0:
+            if should_stop():
+                return False
+            time.sleep(max(0.0, min(0.25, remaining)))
+        return True
+
+class AsyncTransport:
+    # An asyncio event loop on its own thread with one httpx client. Requests draw from the shared rate limit and the
+    # concurrency controller like session requests do, and each host gets its own connection limit on top.
+    def __init__(self, per_host=ASYNC_CONNECTIONS_PER_HOST, http2=False, connections=HTTP2_CONNECTIONS):
+        self.per_host = per_host
+        self.http2 = http2
+        self.connections = connections
+        self.rate_limiter = None
+        self.controller = None
+        self.host_slots = {}
+        self.stats = collections.Counter()
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self.thread.start()
+        self.client = self.run(self._open())
+
+    async def _open(self):
+        # Over HTTP/2 the per-host slots become streams on at most `connections` connections; over HTTP/1.1 every slot is a connection.
+        limits = httpx.Limits(max_connections=self.connections if self.http2 else None, max_keepalive_connections=None)
+        return httpx.AsyncClient(timeout=TIMEOUT, follow_redirects=True, http2=self.http2, limits=limits)
+
+    async def trace(self, event_name, info):
+        if event_name == "connection.connect_tcp.complete":
+            self.stats["connections"] += 1
+        elif event_name == "connection.start_tls.complete":
+            self.stats["handshakes"] += 1
+
+    def run(self, coroutine):
+        # Run coroutine on the loop and wait for it from the calling thread.
+        return self.submit(coroutine).result()
+
+    def submit(self, coroutine):
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop)
+
+    def cancel(self):
+        # Stop: every task on the loop is cancelled, aborting its request or wait at the next await.
+        self.loop.call_soon_threadsafe(lambda: [task.cancel() for task in asyncio.all_tasks(self.loop)])
+
+    async def throttle(self, requests=0, size=0):
+        # reserve() locks and rewrites the shared state file, so it runs on a worker thread instead of the loop.
+        if self.rate_limiter and self.rate_limiter.enabled:
+            await asyncio.sleep(await asyncio.to_thread(self.rate_limiter.reserve, requests, size))
+
+    @asynccontextmanager
+    async def request(self, url, request_headers):
+        # Streams a GET; 429/5xx and transport errors surface as IOError so RetryPolicy treats them like session errors.
+        await self.throttle(requests=1)
+        slot = self.host_slots.setdefault(urllib.parse.urlsplit(url).netloc, asyncio.Semaphore(self.per_host))
+        async with slot:
+            if self.controller:
+                await self.controller.acquire_async()
+            released = not self.controller
+            start = time.time()
+            try:
+                async with self.client.stream("GET", url, headers=request_headers, extensions={"trace": self.trace}) as response:
+                    self.stats["requests"] += 1
+                    self.stats[response.http_version] += 1
+                    if not released:
+                        self.controller.release(response.status_code, time.time() - start)
+                        released = True
+                    if response.status_code == 429 or response.status_code >= 500:
+                        raise IOError(f"HTTP {response.status_code} for {url}")
+                    yield response
+            except httpx.TransportError as e:
+                if not released:
+                    self.controller.release(error=type(e).__name__)
+                    released = True
+                raise IOError(f"{type(e).__name__} for {url}: {str(e)}") from e
+            finally:
+                if not released:
+                    self.controller.release()
+
+    def close(self):
+        self.cancel()
+        self.run(self.client.aclose())
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
+
+class DriverPool:
+    # Headless browsers working through pages concurrently; a dead browser is replaced and its page requeued.
+    def __init__(self, create_driver, is_session_valid, size=BROWSER_INSTANCES):
+        self.create_driver = create_driver
+        self.is_session_valid = is_session_valid
+        self.drivers = [None] * max(1, size)
+
+    def resolve(self, items, fetch, on_done, should_stop):
+        work = queue.Queue()
+        for item in items:
+            work.put((item, 0))
+        threads = [threading.Thread(target=self._resolver, args=(slot, work, fetch, on_done, should_stop), daemon=True)
+                   for slot in range(len(self.drivers))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    def _resolver(self, slot, work, fetch, on_done, should_stop):
+        while not should_stop():
+            try:
+                item, requeues = work.get_nowait()
+            except queue.Empty:
+                return
+            driver = self.drivers[slot]
+            if not driver or not self._healthy(driver):
+                driver = self._replace(slot)
+                if not driver:
+                    work.put((item, requeues))
+                    return
+            session_valid = [True]
+            result = fetch(item, driver, session_valid)
+            if session_valid[0] or should_stop():
+                if session_valid[0]:
+                    on_done(item, result)
+                continue
+            if requeues < MAX_REQUEUES:
+                logger.info(f"Browser {slot + 1} died on {item}, requeueing on a fresh browser.")
+                work.put((item, requeues + 1))
+            else:
+                on_done(item, [])
+            self._replace(slot)
+
+    def _healthy(self, driver):
+        try:
+            return self.is_session_valid(driver)
+        except Exception:
+            return False
+
+    def _replace(self, slot):
+        if self.drivers[slot]:
+            try:
+                self.drivers[slot].quit()
+            except Exception:
+                pass
+        self.drivers[slot] = self.create_driver()
+        return self.drivers[slot]
+
+    def close(self):
+        for slot, driver in enumerate(self.drivers):
+            if driver:
+                try:
+                    driver.quit()
+                except Exception:
+                    pass
+            self.drivers[slot] = None
+
+class ListingPrefetcher:
+    # Scrapes upcoming listing pages into a bounded queue while the artworks of earlier pages are resolved and downloaded.
+    def __init__(self, scrape_page, total_pages, depth=LISTING_READAHEAD):
+        self.queue = queue.Queue(maxsize=max(1, depth))
+        self.stopped = False
+        self.thread = threading.Thread(target=self._run, args=(scrape_page, total_pages), daemon=True)
+        self.thread.start()
+
+    def _run(self, scrape_page, total_pages):
+        for page_num in range(1, total_pages + 1):
+            if self.stopped:
+                return
+            try:
+                item = (page_num, scrape_page(page_num), None)
+            except Exception as e:
+                self._put((page_num, None, e))
+                return
+            if not self._put(item):
+                return
+
+    def _put(self, item):
+        while not self.stopped:
+            try:
+                self.queue.put(item, timeout=0.5)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def get(self, page_num):
+        while True:
+            try:
+                queued_page, page_ids, error = self.queue.get(timeout=0.5)
+            except queue.Empty:
+                if not self.thread.is_alive():
+                    raise RuntimeError(f"Listing prefetch ended before page {page_num}")
+                continue
+            if error:
+                raise error
+            if queued_page == page_num:
+                return page_ids
+
+    def close(self):
+        self.stopped = True
+        self.thread.join(timeout=TIMEOUT)
+
+class ListingCache:
+    # Per-user artwork count, pagination size and per-page artwork IDs, kept in memory and mirrored to disk with a TTL.
+    def __init__(self, path=LISTING_CACHE_FILE, ttl=LISTING_CACHE_TTL):
+        self.path = path
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.entries = {}
+        self.invalidated = set()
+        if path and os.path.exists(path):
+            try:
+                with open(path, "r") as f:
+                    self.entries = json.load(f)
+            except (OSError, ValueError):
+                self.entries = {}
+
+    def get(self, user_id):
+        with self.lock:
+            entry = self.entries.get(user_id)
+            if entry and time.time() - entry["fetched"] <= self.ttl:
+                return entry
+        return None
+
+    def put(self, user_id, count, per_page, pages=None, ids=None):
+        with self.lock:
+            self.entries[user_id] = {"count": count, "per_page": per_page, "pages": {str(n): page for n, page in (pages or {}).items()},
+                                     "ids": ids, "fetched": time.time()}
+        self.save()
+
+    def page(self, user_id, page_num):
+        if entry := self.get(user_id):
+            if entry["ids"]:
+                return entry["ids"][(page_num - 1) * entry["per_page"]:page_num * entry["per_page"]]
+            return entry["pages"].get(str(page_num))
+        return None
+
+    def set_page(self, user_id, page_num, page_ids):
+        with self.lock:
+            if user_id not in self.entries:
+                return
+            self.entries[user_id]["pages"][str(page_num)] = page_ids
+        self.save()
+
+    def invalidate(self, user_id):
+        with self.lock:
+            self.entries.pop(user_id, None)
+            self.invalidated.add(user_id)
+        self.save()
+
+    def save(self):
+        # Other instances write the same file: merge with what is on disk under the file lock, keeping the newer entry
+        # per user, and write through a temp file of our own so concurrent saves never rename each other's file.
+        if not self.path:
+            return
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        with self.lock, file_lock(self.path):
+            try:
+                with open(self.path, "r") as f:
+                    entries = json.load(f)
+            except (OSError, ValueError):
+                entries = {}
+            for user_id in self.invalidated:
+                entries.pop(user_id, None)
+            self.invalidated.clear()
+            for user_id, entry in self.entries.items():
+                other = entries.get(user_id)
+                if other and other["fetched"] == entry["fetched"]:
+                    entry["pages"] = {**other["pages"], **entry["pages"]}
+                if not other or other["fetched"] <= entry["fetched"]:
+                    entries[user_id] = entry
+            now = time.time()
+            self.entries = {user_id: entry for user_id, entry in entries.items() if now - entry["fetched"] <= self.ttl}
+            with tempfile.NamedTemporaryFile("w", dir=os.path.dirname(self.path) or ".", prefix=os.path.basename(self.path),
+                                             suffix=".tmp", delete=False) as f:
+                json.dump(self.entries, f)
+            try:
+                os.replace(f.name, self.path)
+            except OSError:
+                os.remove(f.name)
+                raise
+
+class FailureLog:
+    # Failed artworks of one download folder, persisted as JSON with the last reason, first/last failure time and attempt count.
+    def __init__(self, folder):
+        self.path = os.path.join(folder, FAILURES_FILE)
+        self.entries = {}
+        if os.path.exists(self.path):
+            try:
+                with open(self.path, "r") as f:
+                    self.entries = {entry["artwork_url"]: entry for entry in json.load(f) if self.is_artwork(entry["artwork_url"])}
+            except (OSError, ValueError, KeyError, TypeError):
+                self.entries = {}
+
+    @staticmethod
+    def is_artwork(url):
+        # Listing pages that failed to enumerate are reported with their page URL; Retry Failed only re-runs artworks,
+        # and the next Download All lists those pages again, so they are not recorded here.
+        return bool(re.match(r"https://www\.pixiv\.net(/en)?/artworks/\d+", url))
+
+    def update(self, failed_urls, failed_downloads, completed_urls):
+        for artwork_url in completed_urls:
+            self.entries.pop(artwork_url, None)
+        now = time.strftime("%Y-%m-%dT%H:%M:%S")
+        failures = {url: (page, error, None) for url, page, error in failed_urls if self.is_artwork(url)}
+        for image_url, artwork_url, page, error in failed_downloads:
+            failures.setdefault(artwork_url, (page, error, image_url))
+        for artwork_url, (page, error, image_url) in failures.items():
+            entry = self.entries.get(artwork_url) or {"artwork_url": artwork_url, "first_failed": now, "attempts": 0}
+            entry.update(page=page, reason=error, image_url=image_url, last_failed=now, attempts=entry["attempts"] + 1)
+            self.entries[artwork_url] = entry
+        self.save()
+
+    def save(self):
+        if not self.entries:
+            if os.path.exists(self.path):
+                os.remove(self.path)
+            return
+        with open(self.path + ".tmp", "w") as f:
+            json.dump(sorted(self.entries.values(), key=lambda entry: (entry["page"], entry["artwork_url"])), f, indent=2)
+        os.replace(self.path + ".tmp", self.path)
+
+class Checkpoint:
+    # Progress of one Download All job: its parameters, the artwork order of every page seen and the artworks finished.
+    # Saved every CHECKPOINT_INTERVAL seconds and on exit, so an interrupted job resumes without revisiting finished pages.
+    def __init__(self, folder, params):
+        self.path = os.path.join(folder, CHECKPOINT_FILE)
+        self.lock = threading.RLock()
+        self.data = {"params": params, "total_pages": None, "work_ids": None, "pages": {}, "done": []}
+        self.done = set()
+        self.resumed = False
+        self.cleared = False
+        self.saved = time.time()
+        if os.path.exists(self.path):
+            try:
+                with open(self.path, "r") as f:
+                    data = json.load(f)
+            except (OSError, ValueError):
+                data = {}
+            if data.get("params") == params and data.get("total_pages"):
+                self.data = data
+                self.done = set(data["done"])
+                self.resumed = True
+            else:
+                logger.info("Ignoring checkpoint left by a different Download All job.")
+
+    def start(self, total_pages, work_ids=None):
+        with self.lock:
+            self.data["total_pages"] = total_pages
+            self.data["work_ids"] = work_ids
+            self.save()
+
+    def page(self, page_num):
+        with self.lock:
+            return self.data["pages"].get(str(page_num))
+
+    def record_page(self, page_num, page_ids):
+        with self.lock:
+            self.data["pages"][str(page_num)] = list(page_ids)
+            self.maybe_save()
+
+    def mark_done(self, artwork_id):
+        with self.lock:
+            self.done.add(artwork_id)
+            self.maybe_save()
+
+    def maybe_save(self):
+        if time.time() - self.saved >= CHECKPOINT_INTERVAL:
+            self.save()
+
+    def save(self):
+        with self.lock:
+            if self.cleared:
+                return
+            self.data["done"] = sorted(self.done, key=int, reverse=True)
+            with open(self.path + ".tmp", "w") as f:
+                json.dump(self.data, f)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(self.path + ".tmp", self.path)
+            self.saved = time.time()
+
+    def clear(self):
+        with self.lock:
+            self.cleared = True
+            if os.path.exists(self.path):
+                os.remove(self.path)
+
+class DownloadIndex:
+    # SQLite record of resolved image URLs and completed pages, keyed by artwork ID and page number.
+    def __init__(self, path=INDEX_FILE):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        with self.lock, self.conn:
+            self.conn.execute("CREATE TABLE IF NOT EXISTS artworks (artwork_id TEXT PRIMARY KEY, page_count INTEGER, updated REAL)")
+            self.conn.execute("CREATE TABLE IF NOT EXISTS images (artwork_id TEXT, page INTEGER, url TEXT, filename TEXT, size INTEGER, "
+                              "complete INTEGER DEFAULT 0, updated REAL, PRIMARY KEY (artwork_id, page))")
+            self.conn.execute("CREATE TABLE IF NOT EXISTS users (user_id TEXT PRIMARY KEY, high_water INTEGER, synced REAL)")
+
+    def record_urls(self, artwork_id, image_urls):
+        now = time.time()
+        with self.lock, self.conn:
+            self.conn.execute("INSERT OR REPLACE INTO artworks VALUES (?, ?, ?)", (artwork_id, len(image_urls), now))
+            self.conn.executemany(
+                "INSERT INTO images (artwork_id, page, url, filename, updated) VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT (artwork_id, page) DO UPDATE SET url = excluded.url, filename = excluded.filename, "
+                "complete = CASE WHEN images.filename = excluded.filename THEN images.complete ELSE 0 END, updated = excluded.updated",
+                [(artwork_id, page, url, url.split("/")[-1], now) for page, url in enumerate(image_urls)])
+
+    def mark_complete(self, filename, size):
+        if not (match := re.match(r"(\d+)_p(\d+)\.", filename)):
+            return
+        with self.lock, self.conn:
+            self.conn.execute(
+                "INSERT INTO images (artwork_id, page, filename, size, complete, updated) VALUES (?, ?, ?, ?, 1, ?) "
+                "ON CONFLICT (artwork_id, page) DO UPDATE SET filename = excluded.filename, size = excluded.size, complete = 1, updated = excluded.updated",
+                (match.group(1), int(match.group(2)), filename, size, time.time()))
+
+    def is_complete(self, artwork_id, folder=None):
+        with self.lock:
+            row = self.conn.execute("SELECT page_count FROM artworks WHERE artwork_id = ?", (artwork_id,)).fetchone()
+            if not row or not row[0]:
+                return False
+            images = self.conn.execute("SELECT filename, size FROM images WHERE artwork_id = ? AND page < ? AND complete = 1",
+                                       (artwork_id, row[0])).fetchall()
+        if len(images) < row[0]:
+            return False
+        if folder is None:
+            return True
+        for filename, size in images:
+            path = os.path.join(folder, filename)
+            if not os.path.exists(path) or os.path.getsize(path) != size:
+                return False
+        return True
+
+    def get_high_water(self, user_id):
+        with self.lock:
+            row = self.conn.execute("SELECT high_water FROM users WHERE user_id = ?", (user_id,)).fetchone()
+        return row[0] if row else 0
+
+    def set_high_water(self, user_id, artwork_id):
+        with self.lock, self.conn:
+            self.conn.execute("INSERT INTO users VALUES (?, ?, ?) ON CONFLICT (user_id) DO UPDATE SET "
+                              "high_water = MAX(users.high_water, excluded.high_water), synced = excluded.synced",
+                              (user_id, int(artwork_id), time.time()))
+
+    def rebuild(self, base_folder=save_folder_base):
+        # Re-registers the pages found on disk. Page counts are left to record_urls, since a folder alone cannot
+        # tell a finished artwork from one whose later pages were never downloaded.
+        found = {}
+        for folder, _, filenames in os.walk(base_folder):
+            for filename in filenames:
+                if not (match := re.match(r"(\d+)_p(\d+)\.(png|jpg|jpeg|gif)$", filename)):
+                    continue
+                size = os.path.getsize(os.path.join(folder, filename))
+                if size > 0:
+                    found.setdefault(match.group(1), {})[int(match.group(2))] = (filename, size)
+        now = time.time()
+        with self.lock, self.conn:
+            for artwork_id, pages in found.items():
+                self.conn.executemany(
+                    "INSERT INTO images (artwork_id, page, filename, size, complete, updated) VALUES (?, ?, ?, ?, 1, ?) "
+                    "ON CONFLICT (artwork_id, page) DO UPDATE SET filename = excluded.filename, size = excluded.size, complete = 1, updated = excluded.updated",
+                    [(artwork_id, page, filename, size, now) for page, (filename, size) in pages.items()])
+        return len(found)
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+class PixivAPI:
+    # Resolves artwork IDs and image URLs through pixiv's ajax JSON endpoints with the cookied session.
+    def __init__(self, session, base_url=API_BASE):
+        self.session = session
+        self.base_url = base_url.rstrip("/")
+        self.controller = None
+        self.rate_limiter = None
+        self.retry_policy = None
+
+    def get_json(self, path):
+        if self.retry_policy:
+            return self.retry_policy.call(lambda: self._get_json(path), path, retry_on=(requests.RequestException,))
+        return self._get_json(path)
+
+    def _get_json(self, path):
+        if self.rate_limiter:
+            self.rate_limiter.take(requests=1)
+        if self.controller:
+            self.controller.acquire()
+        try:
+            response = self.session.get(self.base_url + path, headers=headers, timeout=TIMEOUT)
+        except requests.RequestException as e:
+            if self.controller:
+                self.controller.release(error=type(e).__name__)
+            raise
+        if self.controller:
+            self.controller.release(response.status_code, response.elapsed.total_seconds())
+        response.raise_for_status()
+        return self._body(response.json(), path)
+
+    async def get_json_async(self, transport, path):
+        if self.retry_policy:
+            return await self.retry_policy.call_async(lambda: self._get_json_async(transport, path), path)
+        return await self._get_json_async(transport, path)
+
+    async def _get_json_async(self, transport, path):
+        async with transport.request(self.base_url + path, headers) as response:
+            if response.status_code >= 400:
+                raise requests.HTTPError(f"HTTP {response.status_code} for {path}", response=response)
+            data = json.loads(await response.aread())
+        return self._body(data, path)
+
+    @staticmethod
+    def _body(data, path):
+        if data.get("error"):
+            raise ValueError(data.get("message") or f"API error for {path}")
+        return data["body"]
+
+    def get_artwork_ids(self, user_id):
+        body = self.get_json(f"/ajax/user/{user_id}/profile/all")
+        artwork_ids = set(body.get("illusts") or {}) | set(body.get("manga") or {})
+        return sorted(artwork_ids, key=int, reverse=True)
+
+    def get_image_urls(self, artwork_id):
+        body = self.get_json(f"/ajax/illust/{artwork_id}/pages")
+        return [page["urls"]["original"] for page in body]
+
+    async def get_image_urls_async(self, transport, artwork_id):
+        body = await self.get_json_async(transport, f"/ajax/illust/{artwork_id}/pages")
+        return [page["urls"]["original"] for page in body]
+
+class CancelToken:
+    # Cooperative cancellation for one run; cancel() may be called from any thread, including a UI or signal handler.
+    def __init__(self):
+        self.event = threading.Event()
+        self.lock = threading.Lock()
+        self.callbacks = []
+
+    def cancel(self):
+        with self.lock:
+            if self.event.is_set():
+                return
+            self.event.set()
+            callbacks, self.callbacks = self.callbacks, []
+        for callback in callbacks:
+            callback()
+
+    def add_callback(self, callback):
+        # callback() runs once on cancel(), or right away if the token is already cancelled.
+        with self.lock:
+            if not self.event.is_set():
+                self.callbacks.append(callback)
+                return
+        callback()
+
+    @property
+    def cancelled(self):
+        return self.event.is_set()
+
+class CountingHTTPAdapter(HTTPAdapter):
+    # HTTPAdapter that counts real TCP connects and TLS handshakes. urllib3's num_connections only counts connection
+    # objects, and a pooled connection the server closed (e.g. an HTTP/1.0 server) is silently reconnected.
+    def __init__(self, **kwargs):
+        self.stats = collections.Counter()
+        self.stats_lock = threading.Lock()
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        adapter = self
+
+        def counting(pool_cls, tls):
+            class Connection(pool_cls.ConnectionCls):
+                def connect(self):
+                    super().connect()
+                    with adapter.stats_lock:
+                        adapter.stats["connections"] += 1
+                        adapter.stats["handshakes"] += tls
+            return type(pool_cls.__name__, (pool_cls,), {"ConnectionCls": Connection})
+
+        self.poolmanager.pool_classes_by_scheme = {"http": counting(HTTPConnectionPool, False), "https": counting(HTTPSConnectionPool, True)}
+
+    def send(self, request, **kwargs):
+        with self.stats_lock:
+            self.stats["requests"] += 1
+        return super().send(request, **kwargs)
+
+class Setting:
+    # Stand-in for a tk variable when the downloader runs without a Tk root.
+    def __init__(self, value):
+        self.value = value
+
+    def get(self):
+        return self.value
+
+    def set(self, value):
+        self.value = value
+
+class PixivDownloader:
+    # Search, listing, resolution and download machinery; used by the Tk app and by the command-line batch mode.
+    def __init__(self):
         self.driver = None
+        self.driver_lock = threading.Lock()
+        self.driver_path = None
+        self.is_lean = True
+        self.page_loads = []
+        self.wait_times = {}
+        self.controller = None
         self.is_headless = True
         self.cookies = []
         self.cookies_valid = False
         self.user_id = ""
         self.target_count = 0
         self.total_pages = 0
-        self.log_handler = None
-        self.stop_download = False
+        self.token = CancelToken()
+        self.listeners = []
         self.fetch_complete = False
+        self.artwork_ids = []
+        self.artwork_extensions = {}
+        self.completed_urls = set()
+        self.checkpoint = None
+        self.save_folder = save_folder_base
+        self.processed_count = 0
+        self.downloaded_count = 0
+        self.skipped_count = 0
+        self.failed_count = 0
+        self.run_complete = False
         self.session = requests.Session()
-        retries = Retry(total=3, backoff_factor=1, status_forcelist=[429, 500, 502, 503, 504])
-        self.session.mount("https://", HTTPAdapter(max_retries=retries))
-        self.show_browser_var = tk.BooleanVar(value=False)
+        self.pool_size = 0
+        self.connection_baseline = (0, 0, 0)
+        self.api = PixivAPI(self.session)
+        self.rate_limiter = SharedRateLimiter()
+        self.retry_policy = RetryPolicy()
+        self.transport = None
+        self.api.rate_limiter = self.rate_limiter
+        self.api.retry_policy = self.retry_policy
+        self.index = DownloadIndex()
+        self.listing_cache = ListingCache()
+        self.show_browser_var = Setting(False)
+        self.use_api_var = Setting(True)
+        self.lean_var = Setting(True)
+        self.sync_var = Setting(False)
+        self.enumerate_var = Setting(False)
+        self.async_var = Setting(ASYNC_TRANSPORT)
+        self.http2_var = Setting(HTTP2_IMAGES)
+        self.connections_var = Setting(HTTP2_CONNECTIONS)
+        self.rate_limit_var = Setting(RATE_LIMIT_REQUESTS)
+        self.byte_limit_var = Setting(RATE_LIMIT_BYTES // 1024)
+        self.workers_var = Setting(DOWNLOAD_WORKERS)
+        self.browsers_var = Setting(BROWSER_INSTANCES)
+        self.size_connection_pool()
+
+    def load_cookie_file(self):
+        if not os.path.exists(COOKIE_FILE):
+            return False
+        with open(COOKIE_FILE, "r") as f:
+            self.cookies = json.load(f)
+        headers["Cookie"] = "; ".join(f"{c['name']}={c['value']}" for c in self.cookies)
+        self.cookies_valid = True
+        return True
+
+    def lookup_user(self):
+        # Find the artwork count and page count of self.user_id; fetch_complete is set once a download can start.
+        error_occurred = False
+        self.fetch_complete = False
+        self.artwork_ids = []
+        try:
+            if not self.cookies_valid:
+                logger.error("Cookies are not validated. Please save valid cookies first.")
+                return
+            if cached := self.listing_cache.get(self.user_id):
+                if self.use_api_var.get() and cached["ids"]:
+                    self.artwork_ids = cached["ids"]
+                if self.artwork_ids or not self.use_api_var.get():
+                    self.target_count = cached["count"]
+                    self.total_pages = math.ceil(self.target_count / cached["per_page"]) if cached["per_page"] > 0 else 1
+                    logger.info(f"User found (cached). Total artworks available: {self.target_count}")
+                    self.fetch_complete = True
+                    return
+            if self.use_api_var.get():
+                try:
+                    self.artwork_ids = self.api.get_artwork_ids(self.user_id)
+                except Exception as e:
+                    logger.info(f"JSON API unavailable ({str(e)}), falling back to browser.")
+                    self.artwork_ids = []
+                    self.driver = self.restart_driver(self.driver, force_headless=None)
+                else:
+                    self.target_count = len(self.artwork_ids)
+                    if self.target_count == 0:
+                        self.total_pages = 0
+                        logger.error("Invalid User ID or no artworks found.")
+                        return
+                    logger.info(f"User found. Total artworks available: {self.target_count}")
+                    self.total_pages = math.ceil(self.target_count / ARTWORKS_PER_PAGE)
+                    self.listing_cache.put(self.user_id, self.target_count, ARTWORKS_PER_PAGE, ids=self.artwork_ids)
+                    logger.info(f"Calculated {self.total_pages} pages of artworks.")
+                    self.fetch_complete = True
+                    return
+            if not self.driver or not self.is_session_valid(self.driver):
+                logger.error("Browser session invalid or closed. Aborting search.")
+                return
+            base_url = f"https://www.pixiv.net/en/users/{self.user_id}"
+            self.driver.get(base_url)
+            WebDriverWait(self.driver, TIMEOUT).until(
+                EC.presence_of_element_located((By.TAG_NAME, "body"))
+            )
+            soup = BeautifulSoup(self.driver.page_source, "html.parser")
+            h2_tag = soup.find("h2", string=["Illustrations and Manga", "イラスト・マンガ"])
+            if h2_tag and (span_tag := h2_tag.parent.find("span")) and span_tag.text:
+                count_text = span_tag.text.replace(",", "").strip()
+                if count_text.isdigit():
+                    self.target_count = int(count_text)
+                    logger.info(f"User found. Total artworks available: {self.target_count}")
+                else:
+                    logger.error(f"Cannot parse artwork count: '{count_text}' is not a valid number.")
+                    self.target_count = 0
+                    self.total_pages = 0
+                    return
+            else:
+                self.target_count = 0
+                self.total_pages = 0
+                logger.error("Invalid User ID or no artworks found.")
+                return
+
+            artworks_url = f"https://www.pixiv.net/en/users/{self.user_id}/artworks?p=1"
+            self.rate_limiter.take(requests=1)
+            self.driver.get(artworks_url)
+            WebDriverWait(self.driver, TIMEOUT).until(EC.presence_of_element_located((By.XPATH, "//a[contains(@href, '/artworks/')]")))
+            self.wait_for_listing(self.driver)
+            page_ids = extract_artwork_ids(self.driver.page_source)
+            artworks_per_page = len(page_ids)
+            logger.info(f"Page 1: Found {artworks_per_page} unique artworks")
+            self.total_pages = math.ceil(self.target_count / artworks_per_page) if artworks_per_page > 0 else 1
+            self.listing_cache.put(self.user_id, self.target_count, artworks_per_page, pages={1: page_ids})
+            logger.info(f"Calculated {self.total_pages} pages of artworks.")
+            self.fetch_complete = True
+        except (TimeoutException, WebDriverException, InvalidSessionIdException) as e:
+            logger.error(f"Search interrupted: {str(e)}")
+            error_occurred = True
+            self.target_count = 0
+            self.total_pages = 0
+        except Exception as e:
+            logger.error(f"Unexpected error fetching artwork count or pages: {str(e)}")
+            error_occurred = True
+            self.target_count = 0
+            self.total_pages = 0
+        finally:
+            if self.driver and error_occurred:
+                try:
+                    self.driver.quit()
+                except Exception:
+                    pass
+                self.driver = None
+            self.release_driver()
+
+    def ensure_driver(self):
+        self.driver = self.restart_driver(self.driver, force_headless=None)
+        if not self.driver:
+            logger.error("Download aborted: Could not initialize browser.")
+            return False
+        return True
+
+    def subscribe(self, callback):
+        # callback(event) receives every engine event as a dict, on whichever thread raised it:
+        #   run_started  {mode, total}
+        #   page         {page, artworks}
+        #   artwork      {artwork_url, page, status ("downloaded", "skipped" or "failed"), processed, total, percent}
+        #   concurrency  {state}
+        #   run_finished {mode, complete, processed, downloaded, skipped, failed, elapsed}
+        self.listeners.append(callback)
+        return callback
+
+    def unsubscribe(self, callback):
+        if callback in self.listeners:
+            self.listeners.remove(callback)
+
+    def emit(self, name, **fields):
+        event = {"event": name, **fields}
+        for callback in list(self.listeners):
+            try:
+                callback(event)
+            except Exception as e:
+                logger.error(f"Event listener failed on {name}: {str(e)}")
+
+    def resolve(self, artwork_url, token=None):
+        # Image URLs of one artwork, from the JSON API when enabled and the browser otherwise.
+        self.token = token or CancelToken()
+        resolved = []
+        if self.use_api_var.get() and self.resolve_with_api(artwork_url, lambda url, image_urls: resolved.extend(image_urls)):
+            return resolved
+        return self.resolve_with_browser(artwork_url, [True])
+
+    def enumerate_user(self, user_id, token=None):
+        # Every artwork ID of user_id, newest first; [] if the user cannot be found.
+        self.token = token or CancelToken()
+        self.user_id = user_id
+        self.lookup_user()
+        if not self.fetch_complete:
+            return []
+        if self.artwork_ids:
+            return list(self.artwork_ids)
+        if not self.ensure_driver():
+            return []
+        try:
+            return self.enumerate_artwork_ids(self.total_pages, [])
+        finally:
+            self.release_driver()
+
+    def download(self, target, sync=False, retry_failed=False, token=None):
+        # Download one user ID or artwork URL into its usual folder; True once every artwork of the run is complete.
+        self.token = token or CancelToken()
+        if not target.isdigit():
+            artwork_id = target.rstrip("/").split("/")[-1]
+            self.save_folder = os.path.join(save_folder_base, f"pixiv_artwork_{artwork_id}_images")
+            os.makedirs(self.save_folder, exist_ok=True)
+            if not self.use_api_var.get() and not self.ensure_driver():
+                return False
+            self.download_url(target)
+        else:
+            self.user_id = target
+            self.save_folder = os.path.join(save_folder_base, f"pixiv_{target}_images")
+            os.makedirs(self.save_folder, exist_ok=True)
+            if retry_failed:
+                entries = list(FailureLog(self.save_folder).entries.values())
+                if not entries:
+                    logger.info(f"{target}: no failed artworks recorded.")
+                    return True
+                if not self.use_api_var.get() and not self.ensure_driver():
+                    return False
+                self.download_failed(entries)
+            else:
+                logger.info(f"Searching for User ID: {target}")
+                self.lookup_user()
+                if not self.fetch_complete:
+                    return False
+                if not self.artwork_ids and not self.ensure_driver():
+                    return False
+                self.download_all(sync)
+        return self.run_complete and not self.failed_count
+
+    def run_downloads(self, mode, batches, total, show_page=True, dedicated_browsers=False, on_artwork=None, on_finish=None):
+        # The one download path behind every mode. batches(session_valid, failed_urls) yields (page_num, artwork_urls);
+        # pools, progress events, the failure log and the summary are shared. Returns whether the run completed.
+        self.start_time = time.time()
+        self.processed_count = 0
+        self.downloaded_count = 0
+        self.skipped_count = 0
+        self.page_loads = []
+        self.wait_times = {}
+        transport = self.get_transport()
+        self.reset_run_state()
+        session_valid = [True]
+        failed_urls = []
+        page_sizes = {}
+        page_progress = {}
+        page_start_times = {}
+        complete = False
+
+        def on_artwork_done(artwork_url, page_num, statuses):
+            if not self.record_artwork(artwork_url, page_num, statuses, failed_urls):
+                return
+            if on_artwork:
+                on_artwork(artwork_url)
+            page_progress[page_num] = page_progress.get(page_num, 0) + 1
+            elapsed = time.time() - page_start_times[page_num]
+            elapsed_str = f"{int(elapsed // 60):02d}:{int(elapsed % 60):02d}"
+            percent = int((page_progress[page_num] / page_sizes[page_num]) * 100)
+            speed = elapsed / page_progress[page_num]
+            logger.info(f"Downloading Page {page_num}: {percent}% {page_progress[page_num]}/{page_sizes[page_num]} [{elapsed_str}, {speed:.2f}s/artwork]")
+            if total != page_sizes[page_num]:
+                logger.info(f"Processed artworks: {self.processed_count}/{total}")
+            self.emit("artwork", artwork_url=artwork_url, page=page_num, status=self.artwork_status(statuses),
+                      processed=self.processed_count, total=total, percent=(self.processed_count / total) * 100 if total else 100)
+
+        if transport:
+            self.token.add_callback(transport.cancel)
+            pool = AsyncDownloadPool(transport, self.download_image_async, on_artwork_done)
+        else:
+            pool = DownloadPool(self.download_image, on_artwork_done, workers=self.workers_var.get())
+        driver_pool = self.create_driver_pool(dedicated=dedicated_browsers)
+        pages = batches(session_valid, failed_urls)
+        self.emit("run_started", mode=mode, total=total)
+
+        try:
+            for page_num, artwork_urls in pages:
+                page_sizes[page_num] = len(artwork_urls)
+                page_start_times[page_num] = time.time()
+                self.emit("page", page=page_num, artworks=len(artwork_urls))
+                self.queue_artworks(artwork_urls, page_num, pool, session_valid, failed_urls, driver_pool)
+            complete = session_valid[0]
+
+        except (TimeoutException, WebDriverException, InvalidSessionIdException) as e:
+            logger.info(f"Stopping {mode}: {str(e)}")
+        except Exception as e:
+            logger.error(f"Unexpected error in {mode}: {str(e)}")
+        finally:
+            pages.close()
+            if driver_pool:
+                driver_pool.close()
+            pool.close()
+            self.run_complete = complete and not self.token.cancelled
+            if on_finish:
+                on_finish(self.run_complete, failed_urls, pool.failed_downloads)
+            self.log_failures(failed_urls, pool.failed_downloads, show_page)
+            self.print_summary(self.processed_count, total, self.downloaded_count, self.skipped_count, self.start_time)
+            self.release_driver()
+            self.emit("run_finished", mode=mode, complete=self.run_complete, processed=self.processed_count, downloaded=self.downloaded_count,
+                      skipped=self.skipped_count, failed=self.failed_count, elapsed=time.time() - self.start_time)
+        return self.run_complete
+
+    def browser_ready(self, browserless, mode):
+        if browserless or (self.driver and self.is_session_valid(self.driver)):
+            return True
+        logger.error("Browser session invalid or closed. Aborting download.")
+        self.abort_run(mode)
+        return False
+
+    def abort_run(self, mode):
+        # A run that ends before any artwork was queued still reports run_finished so consumers can reset.
+        self.failed_count = 0
+        self.emit("run_finished", mode=mode, complete=False, processed=0, downloaded=0, skipped=0, failed=0, elapsed=0.0)
+
+    def download_all(self, sync=False):
+        browserless = bool(self.artwork_ids)
+        self.run_complete = False
+        if not self.browser_ready(browserless, "download_all"):
+            return False
+        artwork_links_seen = set()
+        high_water = self.index.get_high_water(self.user_id) if sync else 0
+        enumerate_first = not browserless and not sync and self.enumerate_var.get()
+        prefetch = not browserless and not enumerate_first and LISTING_READAHEAD > 0
+        checkpoint = self.checkpoint = Checkpoint(self.save_folder, {"user_id": self.user_id, "sync": sync, "browserless": browserless, "enumerate": enumerate_first})
+
+        def page_ids_for(page_num):
+            if (page_ids := checkpoint.page(page_num)) is not None:
+                return page_ids
+            return self.listing_page_ids(page_num, use_cache=not sync)
+
+        def batches(session_valid, failed_urls):
+            prefetcher = None
+            try:
+                if checkpoint.resumed:
+                    total_pages = checkpoint.data["total_pages"]
+                    work_ids = checkpoint.data["work_ids"]
+                    logger.info(f"Resuming from checkpoint: {len(checkpoint.done)} artworks already done, {len(checkpoint.data['pages'])} of {total_pages} pages listed.")
+                    # They count toward target_count, so the progress still ends at total/total.
+                    self.processed_count += len(checkpoint.done)
+                    self.skipped_count += len(checkpoint.done)
+                elif browserless:
+                    if sync:
+                        self.artwork_ids = self.api.get_artwork_ids(self.user_id)
+                        self.listing_cache.put(self.user_id, len(self.artwork_ids), ARTWORKS_PER_PAGE, ids=self.artwork_ids)
+                    total_pages = math.ceil(len(self.artwork_ids) / ARTWORKS_PER_PAGE)
+                elif (cached := self.listing_cache.get(self.user_id)) and cached["per_page"] > 0:
+                    total_pages = math.ceil(cached["count"] / cached["per_page"])
+                else:
+                    page_ids = self.scrape_listing_page(1)
+                    artworks_per_page = len(page_ids)
+                    total_pages = math.ceil(self.target_count / artworks_per_page) if artworks_per_page > 0 else 1
+                    self.listing_cache.put(self.user_id, self.target_count, artworks_per_page, pages={1: page_ids})
+                if not checkpoint.resumed:
+                    logger.info(f"Calculated {total_pages} pages of artworks.")
+                    work_ids = self.artwork_ids if browserless else None
+                    if enumerate_first:
+                        work_ids = self.enumerate_artwork_ids(total_pages, failed_urls)
+                        total_pages = math.ceil(len(work_ids) / ARTWORKS_PER_PAGE)
+                    elif not browserless and sync and self.enumerate_var.get():
+                        logger.info("Sync mode reads the listing page by page; skipping up-front enumeration.")
+                    checkpoint.start(total_pages, work_ids)
+
+                if prefetch:
+                    prefetcher = ListingPrefetcher(page_ids_for, total_pages)
+
+                for page_num in range(1, total_pages + 1):
+                    if not session_valid[0] or self.token.cancelled:
+                        return
+                    if work_ids is not None:
+                        page_ids = self.work_page_ids(work_ids, page_num)
+                    else:
+                        try:
+                            page_ids = prefetcher.get(page_num) if prefetcher else page_ids_for(page_num)
+                        except (TimeoutException, WebDriverException, InvalidSessionIdException, RuntimeError):
+                            logger.info(f"Stopping process on Page {page_num}: Browser window closed or timed out")
+                            session_valid[0] = False
+                            return
+
+                        if self.token.cancelled:
+                            return
+
+                    if sync and page_ids and all(int(artwork_id) <= high_water or self.index.is_complete(artwork_id) for artwork_id in page_ids):
+                        logger.info(f"Page {page_num}: All artworks already downloaded. Sync complete.")
+                        return
+
+                    checkpoint.record_page(page_num, page_ids)
+                    page_linked = []
+                    already_done = 0
+                    for artwork_id in page_ids:
+                        full_url_normalized = f"https://www.pixiv.net/en/artworks/{artwork_id}"
+                        if full_url_normalized not in artwork_links_seen:
+                            artwork_links_seen.add(full_url_normalized)
+                            if artwork_id in checkpoint.done:
+                                already_done += 1
+                            else:
+                                page_linked.append(full_url_normalized)
+                    logger.info(f"Page {page_num}: Found {len(page_linked)} new artworks (Total so far: {len(artwork_links_seen)})"
+                                + (f", {already_done} already done before the checkpoint" if already_done else ""))
+                    yield page_num, page_linked
+            finally:
+                if prefetcher:
+                    prefetcher.close()
+
+        def on_artwork(artwork_url):
+            if artwork_url in self.completed_urls:
+                checkpoint.mark_done(artwork_url.split("/")[-1])
+
+        def on_finish(complete, failed_urls, failed_downloads):
+            if complete and artwork_links_seen and not failed_urls and not failed_downloads:
+                self.index.set_high_water(self.user_id, max(int(url.split("/")[-1]) for url in artwork_links_seen))
+            if complete:
+                checkpoint.clear()
+            else:
+                checkpoint.save()
+            self.checkpoint = None
+
+        return self.run_downloads("download_all", batches, self.target_count, dedicated_browsers=prefetch, on_artwork=on_artwork, on_finish=on_finish)
+
+    def download_page(self, page_num):
+        browserless = bool(self.artwork_ids)
+        self.run_complete = False
+        if not self.browser_ready(browserless, "download_page"):
+            return False
+        if browserless:
+            page_ids = self.work_page_ids(self.artwork_ids, page_num)
+        else:
+            try:
+                page_ids = self.listing_page_ids(page_num)
+            except (TimeoutException, WebDriverException, InvalidSessionIdException):
+                logger.info(f"Stopping process on Page {page_num}: Browser window closed or timed out")
+                page_ids = None
+        if page_ids is None or self.token.cancelled:
+            if self.token.cancelled:
+                logger.info(f"Session interrupted. Stopping process on Page {page_num}.")
+            self.release_driver()
+            self.abort_run("download_page")
+            return False
+        page_linked = [f"https://www.pixiv.net/en/artworks/{artwork_id}" for artwork_id in dict.fromkeys(page_ids)]
+        logger.info(f"Page {page_num}: Found {len(page_linked)} new artworks (Total so far: {len(page_linked)})")
+
+        def batches(session_valid, failed_urls):
+            yield page_num, page_linked
+
+        return self.run_downloads("download_page", batches, len(page_linked))
+
+    def download_url(self, artwork_url):
+        self.run_complete = False
+        if not self.browser_ready(self.use_api_var.get(), "download_url"):
+            return False
+
+        def batches(session_valid, failed_urls):
+            logger.info(f"Processing artwork URL: {artwork_url}")
+            yield 1, [artwork_url]
+
+        return self.run_downloads("download_url", batches, 1, show_page=False)
+
+    def download_failed(self, entries):
+        self.run_complete = False
+
+        def batches(session_valid, failed_urls):
+            logger.info(f"Retrying {len(entries)} failed artworks for User ID {self.user_id}.")
+            pages = {}
+            for entry in entries:
+                pages.setdefault(entry["page"], []).append(entry["artwork_url"])
+            yield from sorted(pages.items())
+
+        return self.run_downloads("download_failed", batches, len(entries))
+
+    def queue_artworks(self, artwork_urls, page_num, pool, session_valid, failed_urls, driver_pool=None):
+        # Resolve artwork pages on the browser thread(s); the pool downloads the images in the background.
+        queued_urls = set()
+        pending_urls = []
+        for artwork_url in artwork_urls:
+            if self.token.cancelled:
+                break
+            artwork_id = artwork_url.rstrip("/").split("/")[-1]
+            if self.index.is_complete(artwork_id, self.save_folder):
+                logger.info(f"Skipped: artwork {artwork_id} already complete")
+                pool.skip(artwork_url, page_num)
+                queued_urls.add(artwork_url)
+                continue
+            pending_urls.append(artwork_url)
+
+        def on_resolved(artwork_url, image_urls):
+            queued_urls.add(artwork_url)
+            if not image_urls:
+                failed_urls.append((artwork_url, page_num, "Failed to extract image URLs"))
+                return
+            self.index.record_urls(artwork_url.rstrip("/").split("/")[-1], image_urls)
+            pool.submit(artwork_url, page_num, image_urls)
+
+        if self.use_api_var.get() and self.transport and self.transport_enabled():
+            pending_urls = self.resolve_with_api_async(pending_urls, on_resolved)
+        elif self.use_api_var.get():
+            pending_urls = [artwork_url for artwork_url in pending_urls if not self.token.cancelled and not self.resolve_with_api(artwork_url, on_resolved)]
+        if driver_pool:
+            driver_pool.resolve(pending_urls, self.get_image_urls, on_resolved, lambda: self.token.cancelled)
+        else:
+            for artwork_url in pending_urls:
+                if not session_valid[0] or self.token.cancelled:
+                    break
+                image_urls = self.resolve_with_browser(artwork_url, session_valid)
+                if not image_urls and not session_valid[0]:
+                    break
+                on_resolved(artwork_url, image_urls)
+        for remaining_url in artwork_urls:
+            if remaining_url not in queued_urls:
+                failed_urls.append((remaining_url, page_num, "Session interrupted"))
+
+    def create_driver_pool(self, dedicated=False):
+        # A dedicated pool keeps artwork resolution off self.driver while it is busy prefetching listing pages.
+        if not dedicated and self.browsers_var.get() <= 1:
+            return None
+        if not self.use_api_var.get():
+            logger.info(f"Resolving artworks with {self.browsers_var.get()} headless browsers.")
+        lean = self.lean_var.get()
+        return DriverPool(lambda: self.create_driver(headless=True, lean=lean), self.is_session_valid, size=self.browsers_var.get())
+
+    def work_page_ids(self, artwork_ids, page_num):
+        return artwork_ids[(page_num - 1) * ARTWORKS_PER_PAGE:page_num * ARTWORKS_PER_PAGE]
+
+    def resolve_with_api(self, artwork_url, on_resolved):
+        try:
+            image_urls = self.api.get_image_urls(artwork_url.rstrip("/").split("/")[-1])
+        except Exception as e:
+            logger.info(f"JSON API failed for {artwork_url} ({str(e)}), falling back to browser.")
+            return False
+        on_resolved(artwork_url, image_urls)
+        return True
+
+    def resolve_with_api_async(self, artwork_urls, on_resolved):
+        # Resolve the whole batch concurrently on the transport; returns the artworks left for the browser.
+        async def resolve_all():
+            return await asyncio.gather(*(self.api.get_image_urls_async(self.transport, artwork_url.rstrip("/").split("/")[-1])
+                                          for artwork_url in artwork_urls), return_exceptions=True)
+        try:
+            results = self.transport.run(resolve_all())
+        except concurrent.futures.CancelledError:
+            return list(artwork_urls)
+        unresolved = []
+        for artwork_url, result in zip(artwork_urls, results):
+            if isinstance(result, BaseException):
+                if not self.token.cancelled:
+                    logger.info(f"JSON API failed for {artwork_url} ({str(result)}), falling back to browser.")
+                unresolved.append(artwork_url)
+            else:
+                on_resolved(artwork_url, result)
+        return unresolved
+
+    def resolve_with_browser(self, artwork_url, session_valid):
+        if not self.driver or not self.is_session_valid(self.driver):
+            self.driver = self.restart_driver(self.driver, force_headless=None)
+            if not self.driver:
+                logger.error("Could not initialize browser for fallback.")
+                session_valid[0] = False
+                return []
+        return self.get_image_urls(artwork_url, self.driver, session_valid)
+
+    def listing_page_ids(self, page_num, use_cache=True):
+        if use_cache and (page_ids := self.listing_cache.page(self.user_id, page_num)) is not None:
+            return page_ids
+        page_ids = self.scrape_listing_page(page_num)
+        self.listing_cache.set_page(self.user_id, page_num, page_ids)
+        return page_ids
+
+    def scrape_listing_page(self, page_num, driver=None):
+        driver = driver or self.driver
+        if not self.is_session_valid(driver):
+            raise InvalidSessionIdException("Browser window closed")
+        self.rate_limiter.take(requests=1, should_stop=lambda: self.token.cancelled)
+        driver.get(f"https://www.pixiv.net/en/users/{self.user_id}/artworks?p={page_num}")
+        WebDriverWait(driver, TIMEOUT).until(EC.presence_of_element_located((By.XPATH, "//a[contains(@href, '/artworks/')]")))
+        self.wait_for_listing(driver)
+        return extract_artwork_ids(driver.page_source)
+
+    def enumerate_artwork_ids(self, total_pages, failed_urls):
+        # Scrape every listing page up front on a capped set of headless browsers; returns one de-duplicated, newest-first work list.
+        pages = {}
+        pending = []
+        for page_num in range(1, total_pages + 1):
+            if (page_ids := self.listing_cache.page(self.user_id, page_num)) is not None:
+                pages[page_num] = page_ids
+            else:
+                pending.append(page_num)
+
+        def scrape(page_num, driver, session_valid):
+            try:
+                return self.scrape_listing_page(page_num, driver)
+            except (TimeoutException, WebDriverException):
+                session_valid[0] = False
+                return []
+
+        def on_scraped(page_num, page_ids):
+            pages[page_num] = page_ids
+            if page_ids:
+                self.listing_cache.set_page(self.user_id, page_num, page_ids)
+
+        if pending:
+            concurrency = min(ENUMERATE_CONCURRENCY, len(pending))
+            logger.info(f"Enumerating {len(pending)} listing pages with {concurrency} headless browsers.")
+            lean = self.lean_var.get()
+            enumerator = DriverPool(lambda: self.create_driver(headless=True, lean=lean), self.is_session_valid, size=concurrency)
+            try:
+                enumerator.resolve(pending, scrape, on_scraped, lambda: self.token.cancelled)
+            finally:
+                enumerator.close()
+        for page_num in range(1, total_pages + 1):
+            if not pages.get(page_num) and not self.token.cancelled:
+                failed_urls.append((f"https://www.pixiv.net/en/users/{self.user_id}/artworks?p={page_num}", page_num, "Failed to enumerate listing page"))
+        artwork_ids = sorted({artwork_id for page_ids in pages.values() for artwork_id in page_ids}, key=int, reverse=True)
+        logger.info(f"Enumerated {len(artwork_ids)} artworks from {sum(1 for page_ids in pages.values() if page_ids)}/{total_pages} listing pages.")
+        return artwork_ids
+
+    def record_artwork(self, artwork_url, page_num, statuses, failed_urls):
+        if "stopped" in statuses:
+            failed_urls.append((artwork_url, page_num, "Session interrupted"))
+            return False
+        self.processed_count += 1
+        status = self.artwork_status(statuses)
+        if status != "failed":
+            self.completed_urls.add(artwork_url)
+        if status == "skipped":
+            self.skipped_count += 1
+        elif status == "downloaded":
+            self.downloaded_count += 1
+        return True
+
+    @staticmethod
+    def artwork_status(statuses):
+        # One status per artwork from its image statuses: any failed image fails the artwork.
+        if "failed" in statuses:
+            return "failed"
+        return "skipped" if all(status == "skipped" for status in statuses) else "downloaded"
+
+    def image_candidates(self, image_url):
+        # Pages of one artwork can mix extensions and the og:image fallback only guesses png, so a 404 probes the
+        # other extensions; the one that works is tried first for the artwork's remaining pages.
+        base_url, url_ext = image_url.rsplit(".", 1)
+        artwork_id = base_url.split("/")[-1].split("_p")[0]
+        return base_url, artwork_id, list(dict.fromkeys([self.artwork_extensions.get(artwork_id, url_ext), url_ext, *IMAGE_EXTENSIONS]))
+
+    def find_existing_image(self, base_url, candidates):
+        for ext in candidates:
+            filename = f"{base_url.split('/')[-1]}.{ext}"
+            save_path = os.path.join(self.save_folder, filename)
+            if os.path.exists(save_path) and os.path.getsize(save_path) > 0:
+                with open(save_path, "rb") as file:
+                    valid = sniff_image(file.read(16))
+                if valid:
+                    logger.info(f"Skipped: {save_path} already exists")
+                    self.index.mark_complete(filename, os.path.getsize(save_path))
+                    return True
+                logger.info(f"Removing {save_path}: not a valid image")
+                os.remove(save_path)
+        return False
+
+    def download_image(self, image_url):
+        base_url, artwork_id, candidates = self.image_candidates(image_url)
+        if self.find_existing_image(base_url, candidates):
+            return "skipped"
+
+        for ext in candidates:
+            if self.token.cancelled:
+                return "stopped"
+            candidate_url = f"{base_url}.{ext}"
+            filename = candidate_url.split("/")[-1]
+            save_path = os.path.join(self.save_folder, filename)
+            try:
+                completed = self.retry_policy.call(lambda: self.stream_to_file(candidate_url, save_path), filename, should_stop=lambda: self.token.cancelled)
+            except requests.HTTPError as e:
+                if e.response is not None and e.response.status_code == 404 and ext != candidates[-1]:
+                    logger.info(f"{filename} not found, probing the next extension")
+                    continue
+                if self.token.cancelled:
+                    return "stopped"
+                raise
+            except Exception:
+                if self.token.cancelled:
+                    return "stopped"
+                raise
+            if not completed:
+                return "stopped"
+            self.artwork_extensions[artwork_id] = ext
+            logger.info(f"Downloaded: {save_path}")
+            self.index.mark_complete(filename, os.path.getsize(save_path))
+            return "downloaded"
+
+    async def download_image_async(self, image_url):
+        # download_image for the async transport; retries and rate-limit waits suspend the task, not a thread.
+        # File checks, fsync and index writes block, so they run on worker threads and the loop keeps serving transfers.
+        base_url, artwork_id, candidates = self.image_candidates(image_url)
+        if await asyncio.to_thread(self.find_existing_image, base_url, candidates):
+            return "skipped"
+
+        for ext in candidates:
+            if self.token.cancelled:
+                return "stopped"
+            candidate_url = f"{base_url}.{ext}"
+            filename = candidate_url.split("/")[-1]
+            save_path = os.path.join(self.save_folder, filename)
+            try:
+                completed = await self.retry_policy.call_async(lambda: self.stream_to_file_async(candidate_url, save_path), filename)
+            except requests.HTTPError as e:
+                if e.response is not None and e.response.status_code == 404 and ext != candidates[-1]:
+                    logger.info(f"{filename} not found, probing the next extension")
+                    continue
+                if self.token.cancelled:
+                    return "stopped"
+                raise
+            except Exception:
+                if self.token.cancelled:
+                    return "stopped"
+                raise
+            if not completed:
+                return "stopped"
+            self.artwork_extensions[artwork_id] = ext
+            logger.info(f"Downloaded: {save_path}")
+            await asyncio.to_thread(self.index.mark_complete, filename, os.path.getsize(save_path))
+            return "downloaded"
+
+    def image_request_headers(self, part_path):
+        # A leftover .part file from an interrupted attempt or an earlier run is resumed with a Range request.
+        offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+        request_headers = dict(headers, **{"Accept-Encoding": "identity"})
+        if offset:
+            request_headers["Range"] = f"bytes={offset}-"
+        return offset, request_headers
+
+    def check_image_response(self, response, image_url, save_path, offset):
+        # Returns the offset to write at and the expected final size; works on requests and httpx responses.
+        part_path = save_path + ".part"
+        if offset and response.status_code == 416:
+            os.remove(part_path)
+            raise IOError(f"Range not satisfiable for {image_url}, restarting from zero")
+        if response.status_code not in (200, 206):
+            if response.status_code >= 400:
+                raise requests.HTTPError(f"HTTP {response.status_code} for {image_url}", response=response)
+            raise IOError(f"Unexpected HTTP {response.status_code} for {image_url}")
+        content_type = response.headers.get("Content-Type", "")
+        if content_type and not content_type.startswith(("image/", "application/octet-stream")):
+            raise ValueError(f"{image_url} returned {content_type.split(';')[0]} instead of an image")
+        expected_size = None
+        if offset and response.status_code == 206:
+            if range_match := re.match(r"bytes (\d+)-\d+/(\d+)", response.headers.get("Content-Range", "")):
+                if int(range_match.group(1)) != offset:
+                    os.remove(part_path)
+                    raise IOError(f"Server resumed {image_url} at the wrong offset")
+                expected_size = int(range_match.group(2))
+            logger.info(f"Resuming {os.path.basename(save_path)} from byte {offset}")
+        else:
+            if offset:
+                logger.info(f"Server ignored range for {os.path.basename(save_path)}, downloading in full")
+            offset = 0
+            if content_length := response.headers.get("Content-Length"):
+                expected_size = int(content_length)
+        return offset, expected_size
+
+    async def stream_to_file_async(self, image_url, save_path):
+        part_path = save_path + ".part"
+        offset, request_headers = self.image_request_headers(part_path)
+        async with self.transport.request(image_url, request_headers) as response:
+            offset, expected_size = self.check_image_response(response, image_url, save_path, offset)
+            transfer_start = time.time()
+            with open(part_path, "ab" if offset else "wb") as file:
+                async for chunk in response.aiter_bytes(CHUNK_SIZE):
+                    if self.token.cancelled:
+                        return False
+                    await self.transport.throttle(size=len(chunk))
+                    file.write(chunk)
+                file.flush()
+                await asyncio.to_thread(os.fsync, file.fileno())
+        return await asyncio.to_thread(self.finish_part, image_url, save_path, offset, expected_size, transfer_start)
+
+    def stream_to_file(self, image_url, save_path):
+        # Write into a .part file and only rename it once the body is complete and flushed to disk.
+        part_path = save_path + ".part"
+        offset, request_headers = self.image_request_headers(part_path)
+        with self.session_request(image_url, headers=request_headers, timeout=10, stream=True) as response:
+            offset, expected_size = self.check_image_response(response, image_url, save_path, offset)
+            transfer_start = time.time()
+            with open(part_path, "ab" if offset else "wb") as file:
+                for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+                    if self.token.cancelled or not self.rate_limiter.take(size=len(chunk), should_stop=lambda: self.token.cancelled):
+                        return False
+                    file.write(chunk)
+                file.flush()
+                os.fsync(file.fileno())
+        return self.finish_part(image_url, save_path, offset, expected_size, transfer_start)
+
+    def finish_part(self, image_url, save_path, offset, expected_size, transfer_start):
+        part_path = save_path + ".part"
+        size = os.path.getsize(part_path)
+        if self.controller:
+            self.controller.record_transfer(size - offset, time.time() - transfer_start)
+        if expected_size is not None and size != expected_size:
+            if size > expected_size:
+                os.remove(part_path)
+            raise IOError(f"Incomplete download of {image_url}: {size}/{expected_size} bytes")
+        with open(part_path, "rb") as file:
+            valid = sniff_image(file.read(16))
+        if not valid:
+            os.remove(part_path)
+            raise ValueError(f"{image_url} is not a PNG, JPEG or GIF image")
+        os.replace(part_path, save_path)
+        return True
+
+    def session_request(self, url, **kwargs):
+        # Every image request draws from the shared rate limit, then takes a slot from the concurrency controller
+        # and reports its status and header latency back.
+        if not self.rate_limiter.take(requests=1, should_stop=lambda: self.token.cancelled):
+            raise IOError("Download stopped")
+        if self.controller and not self.controller.acquire(lambda: self.token.cancelled):
+            raise IOError("Download stopped")
+        try:
+            response = self.session.get(url, **kwargs)
+        except requests.RequestException as e:
+            if self.controller:
+                self.controller.release(error=type(e).__name__)
+            raise
+        if self.controller:
+            self.controller.release(response.status_code, response.elapsed.total_seconds())
+        if response.status_code == 429 or response.status_code >= 500:
+            response.close()
+            raise IOError(f"HTTP {response.status_code} for {url}")
+        return response
+
+    def get_transport(self):
+        # The async transport is optional; without httpx the download threads and the requests session are used.
+        # HTTP/2 is only offered through it, so asking for HTTP/2 turns the transport on as well.
+        if not self.transport_enabled():
+            return None
+        if not httpx:
+            logger.info("Async transfers and HTTP/2 need httpx (pip install httpx[http2]); using the download threads instead.")
+            self.async_var.set(False)
+            self.http2_var.set(False)
+            return None
+        if self.http2_var.get() and not h2:
+            logger.info("HTTP/2 needs the h2 package (pip install httpx[http2]); using HTTP/1.1.")
+            self.http2_var.set(False)
+            if not self.async_var.get():
+                return None
+        http2 = self.http2_var.get()
+        connections = self.connections_var.get() if http2 else HTTP2_CONNECTIONS
+        if self.transport and (self.transport.http2, self.transport.connections) != (http2, connections):
+            self.transport.close()
+            self.transport = None
+        if not self.transport:
+            self.transport = AsyncTransport(http2=http2, connections=connections)
+            self.transport.rate_limiter = self.rate_limiter
+        return self.transport
+
+    def transport_enabled(self):
+        return self.async_var.get() or self.http2_var.get()
+
+    def size_connection_pool(self):
+        # urllib3 keeps 10 connections per host by default; size the pool to the download workers (plus one for the
+        # thread resolving artworks) so every worker reuses a kept-alive connection and none are opened and dropped.
+        size = self.workers_var.get() + 1
+        if size == self.pool_size:
+            return
+        if self.pool_size:
+            self.session.adapters["https://"].close()
+        # Retries are owned by self.retry_policy; urllib3 must not retry underneath it.
+        adapter = CountingHTTPAdapter(max_retries=0, pool_maxsize=size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.pool_size = size
+
+    def session_connection_stats(self):
+        # Requests, TCP connects and TLS handshakes seen by the session's adapter (one adapter serves http and https).
+        adapter = self.session.adapters["https://"]
+        with adapter.stats_lock:
+            return adapter.stats["requests"], adapter.stats["connections"], adapter.stats["handshakes"]
+
+    def reset_run_state(self):
+        self.completed_urls = set()
+        self.size_connection_pool()
+        self.connection_baseline = self.session_connection_stats()
+        if self.transport:
+            self.transport.stats.clear()
+        max_limit = self.transport.per_host if self.transport and self.transport_enabled() else self.workers_var.get()
+        self.controller = ConcurrencyController(max_limit, on_change=self.on_concurrency_change) if ADAPTIVE_CONCURRENCY else None
+        self.api.controller = self.controller
+        if self.transport:
+            self.transport.controller = self.controller
+        self.rate_limiter.requests_per_sec = self.rate_limit_var.get()
+        self.rate_limiter.bytes_per_sec = self.byte_limit_var.get() * 1024
+        self.rate_limiter.waited = 0.0
+        self.retry_policy.reset()
+        self.emit("concurrency", state=self.controller.state() if self.controller else None)
+
+    def on_concurrency_change(self, previous, limit, reason):
+        logger.info(f"Concurrency {previous} -> {limit} ({reason})")
+        self.emit("concurrency", state=self.controller.state())
+
+    def log_connection_stats(self):
+        requests_made, connections, handshakes = (now - before for now, before in zip(self.session_connection_stats(), self.connection_baseline))
+        if requests_made:
+            logger.info(f"Session connections: {requests_made} requests over {connections} new connections ({handshakes} TLS handshakes), "
+                        f"{max(0, requests_made - connections) / requests_made * 100:.0f}% reused")
+        if self.transport and (stats := self.transport.stats)["requests"]:
+            versions = ", ".join(f"{count} {version}" for version, count in sorted(stats.items(), reverse=True) if version.startswith("HTTP/"))
+            logger.info(f"Async connections: {stats['requests']} requests ({versions}) over {stats['connections']} new connections "
+                        f"({stats['handshakes']} TLS handshakes), {max(0, stats['requests'] - stats['connections']) / stats['requests'] * 100:.0f}% reused")
+
+    def log_failures(self, failed_urls, failed_downloads, show_page=True):
+        if self.token.cancelled:
+            # Artworks cut short or never reached because of Stop did not fail; they are neither counted nor saved to failed.json.
+            failed_urls = [entry for entry in failed_urls if entry[2] != "Session interrupted"]
+        self.failed_count = len(failed_urls) + len(failed_downloads)
+        if failed_urls:
+            logger.info("Failed artworks:")
+            for url, page, error in failed_urls:
+                logger.info(f"  {url} (Page {page}): {error}" if show_page else f"  {url}: {error}")
+        if failed_downloads:
+            logger.info("Failed downloads:")
+            for image_url, artwork_url, page, error in failed_downloads:
+                logger.info(f"  {image_url} from {artwork_url} (Page {page}): {error}" if show_page else f"  {image_url} from {artwork_url}: {error}")
+        failure_log = FailureLog(self.save_folder)
+        failure_log.update(failed_urls, failed_downloads, self.completed_urls)
+        if failure_log.entries:
+            logger.info(f"{len(failure_log.entries)} failed artworks recorded in {failure_log.path}; use \"Retry Failed\" to process them again.")
+
+    def restart_driver(self, existing_driver=None, force_headless=None):
+        # If force_headless is None, respect the show_browser_var toggle
+        if force_headless is None:
+            desired_headless = not self.show_browser_var.get()
+        else:
+            # If force_headless is explicitly set, it takes precedence
+            desired_headless = force_headless
+        
+        desired_lean = self.lean_var.get()
+        if existing_driver and self.is_session_valid(existing_driver):
+            if self.is_headless == desired_headless and self.is_lean == desired_lean:
+                return existing_driver
+            else:
+                try:
+                    existing_driver.quit()
+                except Exception:
+                    pass
+        
+        self.is_headless = desired_headless
+        self.is_lean = desired_lean
+        return self.create_driver(self.is_headless, self.is_lean)
+
+    def get_driver_path(self):
+        # ChromeDriverManager().install() does a version lookup, so resolve the binary once per app run.
+        with self.driver_lock:
+            if not self.driver_path:
+                self.driver_path = ChromeDriverManager().install()
+            return self.driver_path
+
+    def release_driver(self):
+        # Keep the browser warm for the next operation; only drop it if its session is gone.
+        if self.driver and not self.is_session_valid(self.driver):
+            self.driver = None
+
+    def create_driver(self, headless=True, lean=True):
+        options = webdriver.ChromeOptions()
+        options.add_argument('--log-level=3')
+        if headless:
+            options.add_argument('--headless=new')
+        if lean:
+            options.add_experimental_option("prefs", {
+                "profile.managed_default_content_settings.images": 2,
+                "profile.managed_default_content_settings.media_stream": 2,
+            })
+        
+        try:
+            with redirect_stdout(StringIO()):
+                new_driver = webdriver.Chrome(service=Service(self.get_driver_path()), options=options)
+            if lean:
+                blocked_urls = LEAN_BLOCKED_URLS + (LEAN_BLOCKED_SCRIPTS if BLOCK_THIRD_PARTY_SCRIPTS else [])
+                new_driver.execute_cdp_cmd("Network.enable", {})
+                new_driver.execute_cdp_cmd("Network.setBlockedURLs", {"urls": blocked_urls})
+            new_driver.get("https://www.pixiv.net")
+            for cookie in self.cookies:
+                try:
+                    new_driver.add_cookie(cookie)
+                except Exception:
+                    logger.error("Browser window closed during cookie setup.")
+                    new_driver.quit()
+                    return None
+            return new_driver
+        except Exception as e:
+            logger.exception(f"Unexpected error initializing ChromeDriver: {e}")
+            return None
+
+    def wait_until(self, driver, name, condition, timeout=READY_TIMEOUT):
+        # Bounded readiness wait; the time actually spent is recorded per wait name for the run summary.
+        start = time.perf_counter()
+        try:
+            WebDriverWait(driver, timeout, poll_frequency=0.1).until(condition)
+            ready = True
+        except TimeoutException:
+            ready = False
+        self.wait_times.setdefault(name, []).append((time.perf_counter() - start, ready))
+        return ready
+
+    def wait_for_listing(self, driver):
+        # Scroll to trigger lazy loading, then wait until the number of artwork links stops changing.
+        driver.execute_script("window.scrollTo(0, document.body.scrollHeight);")
+        state = {"count": -1, "since": time.perf_counter()}
+
+        def settled(d):
+            count = d.execute_script("return document.querySelectorAll(\"a[href*='/artworks/']\").length")
+            now = time.perf_counter()
+            if count != state["count"]:
+                state["count"], state["since"] = count, now
+                return False
+            return count > 0 and now - state["since"] >= LISTING_SETTLE_TIME
+
+        ready = self.wait_until(driver, "listing", settled)
+        self.record_page_load(driver)
+        return ready
+
+    def record_page_load(self, driver):
+        try:
+            self.page_loads.append(driver.execute_script(PAGE_LOAD_STATS_JS))
+        except WebDriverException:
+            pass
+
+    def measure_lean_savings(self, url, samples=3):
+        # Load the same page with a full and a lean headless browser (cache disabled) and log the difference.
+        results = {}
+        for lean in (False, True):
+            driver = self.create_driver(headless=True, lean=lean)
+            if not driver:
+                return None
+            try:
+                driver.execute_cdp_cmd("Network.setCacheDisabled", {"cacheDisabled": True})
+                loads = []
+                for _ in range(samples):
+                    driver.get(url)
+                    WebDriverWait(driver, TIMEOUT).until(lambda d: d.execute_script("return document.readyState") == "complete")
+                    loads.append(driver.execute_script(PAGE_LOAD_STATS_JS))
+                results[lean] = (sum(b for b, _ in loads) / samples, sum(ms for _, ms in loads) / samples)
+            finally:
+                driver.quit()
+        (full_bytes, full_ms), (lean_bytes, lean_ms) = results[False], results[True]
+        logger.info(f"Full page load: {full_bytes / 1024:.0f} KB in {full_ms:.0f} ms; lean: {lean_bytes / 1024:.0f} KB in {lean_ms:.0f} ms")
+        logger.info(f"Lean browsing saves {(full_bytes - lean_bytes) / 1024:.0f} KB and {full_ms - lean_ms:.0f} ms per page load of {url}")
+        return results
+
+    def is_session_valid(self, driver):
+        try:
+            driver.current_url
+            return True
+        except WebDriverException:
+            return False
+
+    def get_image_urls(self, artwork_url, driver, session_valid_ref):
+        if self.token.cancelled or not self.is_session_valid(driver):
+            logger.info(f"Stopping process for {artwork_url}: Session interrupted (window closed or stopped)")
+            session_valid_ref[0] = False
+            return []
+
+        def load_artwork():
+            self.rate_limiter.take(requests=1, should_stop=lambda: self.token.cancelled)
+            driver.get(artwork_url)
+            WebDriverWait(driver, TIMEOUT).until(
+                lambda d: d.find_elements(By.CSS_SELECTOR, "div[aria-label='Preview'], div[aria-label='プレビュー']") or 
+                        d.find_elements(By.TAG_NAME, "img")
+            )
+            self.wait_until(driver, "artwork", lambda d: d.execute_script(ARTWORK_READY_JS))
+            self.record_page_load(driver)
+            return extract_artwork(driver.page_source, artwork_url.rstrip("/").split("/")[-1])
+
+        try:
+            artwork = self.retry_policy.call(load_artwork, artwork_url, should_stop=lambda: self.token.cancelled, retry_on=(TimeoutException, WebDriverException),
+                                             is_retryable=lambda e: not isinstance(e, (InvalidSessionIdException, NoSuchWindowException)))
+        except (InvalidSessionIdException, NoSuchWindowException):
+            logger.info(f"Stopping process for {artwork_url}: Browser window closed")
+            session_valid_ref[0] = False
+            return []
+        except (TimeoutException, WebDriverException) as e:
+            if self.token.cancelled:
+                session_valid_ref[0] = False
+                return []
+            logger.error(f"Failed to get URLs for {artwork_url}: {str(e)}")
+            return []
+        except Exception as e:
+            logger.error(f"Unexpected error for {artwork_url}: {str(e)}")
+            session_valid_ref[0] = False
+            return []
+
+        if not artwork:
+            logger.error(f"No valid image URL pattern found for {artwork_url}")
+            return []
+        base_url, ext, page_count, page_count_found = artwork
+        if page_count_found:
+            logger.info(f"Detected {page_count} pages for {artwork_url}")
+
+        image_urls = [f"{base_url}_p{i}.{ext}" for i in range(page_count)]
+        logger.info(f"Generated {len(image_urls)} image URLs for {artwork_url}")
+        return image_urls
+
+    def print_summary(self, processed_count, target_count, downloaded_count, skipped_count, start_time):
+        total_time = time.time() - start_time
+        time_str = f"{int(total_time // 60):02d}:{int(total_time % 60):02d}"
+        logger.info(f"Total artworks processed: {processed_count}/{target_count} ({downloaded_count} downloaded, {skipped_count} skipped) in {time_str}")
+        if self.controller and self.controller.requests:
+            logger.info(f"HTTP requests: {self.controller.requests} ({self.controller.throttled} throttled, {self.controller.errors} errors), final concurrency {self.controller.state()}")
+        self.log_connection_stats()
+        if self.rate_limiter.waited:
+            logger.info(f"Shared rate limit: waited {self.rate_limiter.waited:.1f}s in total")
+        if self.retry_policy.retries or self.retry_policy.trips:
+            logger.info(f"Retries: {self.retry_policy.retries} of {self.retry_policy.requests} attempts, circuit opened {self.retry_policy.trips} times")
+        if self.page_loads:
+            loads = len(self.page_loads)
+            avg_kb = sum(b for b, _ in self.page_loads) / loads / 1024
+            avg_ms = sum(ms for _, ms in self.page_loads) / loads
+            logger.info(f"Browser page loads: {loads} ({'lean' if self.is_lean else 'full'}), avg {avg_kb:.0f} KB in {avg_ms:.0f} ms")
+        for name, waits in self.wait_times.items():
+            durations = sorted(duration for duration, _ in waits)
+            timeouts = sum(1 for _, ready in waits if not ready)
+            p50 = durations[len(durations) // 2]
+            p90 = durations[min(len(durations) - 1, int(len(durations) * 0.9))]
+            logger.info(f"Wait '{name}': {len(durations)} waits, p50 {p50:.2f}s, p90 {p90:.2f}s, max {durations[-1]:.2f}s, {timeouts} timed out")
+
+    def close(self):
+        self.token.cancel()
+        if self.checkpoint:
+            self.checkpoint.save()
+        if self.driver:
+            try:
+                self.driver.quit()
+            except Exception:
+                pass
+            self.driver = None
+        self.session.close()
+        if self.transport:
+            self.transport.close()
+        self.index.close()
+
+class PixivDownloaderApp(PixivDownloader):
+    def __init__(self, root):
+        super().__init__()
+        self.root = root
+        self.root.title(f"get pixiv")
+        self.log_handler = None
+        # Tk-backed versions of the engine settings, so the Options widgets can bind to them.
+        self.show_browser_var = tk.BooleanVar(value=self.show_browser_var.get())
+        self.use_api_var = tk.BooleanVar(value=self.use_api_var.get())
+        self.lean_var = tk.BooleanVar(value=self.lean_var.get())
+        self.sync_var = tk.BooleanVar(value=self.sync_var.get())
+        self.enumerate_var = tk.BooleanVar(value=self.enumerate_var.get())
+        self.async_var = tk.BooleanVar(value=self.async_var.get())
+        self.http2_var = tk.BooleanVar(value=self.http2_var.get())
+        self.connections_var = tk.IntVar(value=self.connections_var.get())
+        self.rate_limit_var = tk.DoubleVar(value=self.rate_limit_var.get())
+        self.byte_limit_var = tk.IntVar(value=self.byte_limit_var.get())
+        self.workers_var = tk.IntVar(value=self.workers_var.get())
+        self.browsers_var = tk.IntVar(value=self.browsers_var.get())
+        self.subscribe(self.on_engine_event)
         self.setup_ui()
         self.load_cookies()
         self.root.update_idletasks()
@@ -147,6 +2472,23 @@ class PixivDownloaderApp:
         ttk.Checkbutton(options_frame, text="Show browser", variable=self.show_browser_var).grid(row=0, column=0, padx=5, pady=5)
         self.about_button = ttk.Button(options_frame, text="About", command=self.show_about)
         self.about_button.grid(row=0, column=1, padx=5, pady=5)
+        ttk.Label(options_frame, text="Download workers:").grid(row=0, column=2, padx=(5, 0), pady=5)
+        ttk.Spinbox(options_frame, from_=1, to=16, width=4, textvariable=self.workers_var, state="readonly").grid(row=0, column=3, padx=5, pady=5)
+        ttk.Checkbutton(options_frame, text="Browserless (JSON API)", variable=self.use_api_var).grid(row=1, column=0, columnspan=2, padx=5, pady=5, sticky="w")
+        self.rebuild_index_button = ttk.Button(options_frame, text="Rebuild Index", command=self.rebuild_index)
+        self.rebuild_index_button.grid(row=1, column=2, columnspan=2, padx=5, pady=5)
+        ttk.Checkbutton(options_frame, text="Lean browsing (no images/fonts)", variable=self.lean_var).grid(row=2, column=0, columnspan=2, padx=5, pady=5, sticky="w")
+        ttk.Label(options_frame, text="Browser instances:").grid(row=2, column=2, padx=(5, 0), pady=5)
+        ttk.Spinbox(options_frame, from_=1, to=8, width=4, textvariable=self.browsers_var, state="readonly").grid(row=2, column=3, padx=5, pady=5)
+        ttk.Checkbutton(options_frame, text="Enumerate all listing pages first", variable=self.enumerate_var).grid(row=3, column=0, columnspan=2, padx=5, pady=5, sticky="w")
+        ttk.Checkbutton(options_frame, text="Async transfers (httpx)", variable=self.async_var).grid(row=3, column=2, columnspan=2, padx=5, pady=5, sticky="w")
+        ttk.Checkbutton(options_frame, text="HTTP/2 images (httpx[http2])", variable=self.http2_var).grid(row=4, column=0, columnspan=2, padx=5, pady=5, sticky="w")
+        ttk.Label(options_frame, text="HTTP/2 connections:").grid(row=4, column=2, padx=(5, 0), pady=5)
+        ttk.Spinbox(options_frame, from_=1, to=8, width=4, textvariable=self.connections_var, state="readonly").grid(row=4, column=3, padx=5, pady=5)
+        ttk.Label(options_frame, text="Shared limit, requests/s (0 = off):").grid(row=5, column=0, padx=(5, 0), pady=5, sticky="w")
+        ttk.Spinbox(options_frame, values=(0, 0.5, 1, 2, 3, 5, 10, 20), width=6, textvariable=self.rate_limit_var, state="readonly").grid(row=5, column=1, padx=5, pady=5, sticky="w")
+        ttk.Label(options_frame, text="KB/s (0 = off):").grid(row=5, column=2, padx=(5, 0), pady=5)
+        ttk.Spinbox(options_frame, values=(0, 256, 512, 1024, 2048, 5120, 10240), width=8, textvariable=self.byte_limit_var, state="readonly").grid(row=5, column=3, padx=5, pady=5)
 
         # Search User ID Frame
         user_frame = ttk.LabelFrame(self.root, text="Search User ID")
@@ -172,6 +2514,9 @@ class PixivDownloaderApp:
 
         self.download_button = ttk.Button(download_frame, text="Download All", command=self.start_download, state="disabled", width=15)
         self.download_button.grid(row=1, column=0, padx=5, pady=5)
+        ttk.Checkbutton(download_frame, text="New artworks only (sync)", variable=self.sync_var).grid(row=1, column=1, padx=0, pady=5, sticky="w")
+        self.retry_failed_button = ttk.Button(download_frame, text="Retry Failed", command=self.start_retry_failed, state="disabled")
+        self.retry_failed_button.grid(row=1, column=2, columnspan=2, padx=0, pady=5)
 
         self.download_page_button = ttk.Button(download_frame, text="Download Page", command=self.start_download_page, state="disabled", width=15)
         self.download_page_button.grid(row=2, column=0, padx=5, pady=5)
@@ -196,6 +2541,8 @@ class PixivDownloaderApp:
 
         self.stop_button = ttk.Button(download_frame, text="Stop", command=self.stop_download_process, state="disabled", width=15)
         self.stop_button.grid(row=4, column=0, pady=5)
+        self.concurrency_label = ttk.Label(download_frame, text="Concurrency: -")
+        self.concurrency_label.grid(row=4, column=1, columnspan=3, padx=0, pady=5, sticky="w")
 
         # Log Frame
         log_frame = ttk.LabelFrame(self.root, text="Log")
@@ -213,6 +2560,20 @@ class PixivDownloaderApp:
         self.log_handler = TextHandler(self.log_text)
         logger.addHandler(self.log_handler)
 
+    def rebuild_index(self):
+        self.rebuild_index_button.config(state="disabled")
+
+        def run():
+            try:
+                count = self.index.rebuild(save_folder_base)
+                logger.info(f"Download index rebuilt from {save_folder_base}: {count} artworks found.")
+            except Exception as e:
+                logger.error(f"Failed to rebuild download index: {str(e)}")
+            finally:
+                self.root.after(0, lambda: self.rebuild_index_button.config(state="normal"))
+
+        threading.Thread(target=run, daemon=True).start()
+
     def show_about(self):
         about_window = tk.Toplevel(self.root)
         about_window.title("About")
@@ -340,6 +2701,12 @@ class PixivDownloaderApp:
             with open(COOKIE_FILE, "w") as f:
                 json.dump(self.cookies, f)
             headers["Cookie"] = "; ".join(f"{c['name']}={c['value']}" for c in self.cookies)
+            if self.driver:
+                try:
+                    self.driver.quit()
+                except Exception:
+                    pass
+                self.driver = None
             self.cookies_valid = True
             self.clear_cookie_button.config(state="normal")
             self.search_button.config(state="normal")
@@ -365,6 +2732,7 @@ class PixivDownloaderApp:
         self.clear_cookie_button.config(state="disabled")
         self.search_button.config(state="disabled")
         self.download_button.config(state="disabled")
+        self.retry_failed_button.config(state="disabled")
         self.download_page_button.config(state="disabled")
         self.download_url_button.config(state="disabled")
         self.user_id_entry.delete(0, tk.END)
@@ -382,12 +2750,7 @@ class PixivDownloaderApp:
             json.dump(self.cookies, f)
 
     def load_cookies(self):
-        if os.path.exists(COOKIE_FILE):
-            with open(COOKIE_FILE, "r") as f:
-                self.cookies = json.load(f)
-            
-            headers["Cookie"] = "; ".join(f"{c['name']}={c['value']}" for c in self.cookies)
-            self.cookies_valid = True
+        if self.load_cookie_file():
             self.clear_cookie_button.config(state="normal")
             self.search_button.config(state="normal")
             self.download_url_button.config(state="normal")
@@ -419,7 +2782,8 @@ class PixivDownloaderApp:
         logger.info("Verifying cookies...")
         self.verify_cookies_button.config(state="disabled")
         
-        driver = self.restart_driver(None, force_headless=False)
+        self.driver = self.restart_driver(self.driver, force_headless=False)
+        driver = self.driver
         if not driver:
             logger.error("Could not initialize browser for cookie verification.")
             self.verify_cookies_button.config(state="normal")
@@ -440,7 +2804,7 @@ class PixivDownloaderApp:
         except Exception as e:
             logger.error(f"Error verifying cookies: {e}")
         finally:
-            driver.quit()
+            self.release_driver()
             self.verify_cookies_button.config(state="normal")
 
     def search_user_id(self):
@@ -451,19 +2815,22 @@ class PixivDownloaderApp:
 
         self.search_button.config(state="disabled")
         self.download_button.config(state="disabled")
+        self.retry_failed_button.config(state="disabled")
         self.download_page_button.config(state="disabled")
         self.download_url_button.config(state="disabled")
         self.verify_cookies_button.config(state="disabled")
         logger.info(f"Searching for User ID: {self.user_id}")
-        self.driver = self.restart_driver(self.driver, force_headless=None)
-        if not self.driver:
-            logger.error("Search aborted: Could not initialize browser.")
-            self.search_button.config(state="normal")
-            self.download_url_button.config(state="normal")
-            self.verify_cookies_button.config(state="normal")
-            return
-        
-        self.driver.get(f"https://www.pixiv.net/en/users/{self.user_id}")
+        self.artwork_ids = []
+        if not self.use_api_var.get():
+            self.driver = self.restart_driver(self.driver, force_headless=None)
+            if not self.driver:
+                logger.error("Search aborted: Could not initialize browser.")
+                self.search_button.config(state="normal")
+                self.download_url_button.config(state="normal")
+                self.verify_cookies_button.config(state="normal")
+                return
+
+            self.driver.get(f"https://www.pixiv.net/en/users/{self.user_id}")
         threading.Thread(target=self.fetch_artwork_count_and_pages, daemon=True).start()
 
     def clear_user_id(self):
@@ -486,119 +2853,41 @@ class PixivDownloaderApp:
             self.cookie_entry.delete(0, tk.END)
             self.cookie_entry.insert(0, clipboard_text)
         except tk.TclError:
-            pass
-
-    def clear_url(self):
-        self.url_entry.delete(0, tk.END)
-
-    def paste_url(self):
-        try:
-            clipboard_text = self.root.clipboard_get()
-            self.url_entry.delete(0, tk.END)
-            self.url_entry.insert(0, clipboard_text)
-        except tk.TclError:
-            pass
-
-    def fetch_artwork_count_and_pages(self):
-        error_occurred = False
-        try:
-            if not self.cookies_valid:
-                logger.error("Cookies are not validated. Please save valid cookies first.")
-                return
-            if not self.driver or not self.is_session_valid(self.driver):
-                logger.error("Browser session invalid or closed. Aborting search.")
-                self.fetch_complete = False
-                self.root.after(0, self.reset_ui)
-                return
-            base_url = f"https://www.pixiv.net/en/users/{self.user_id}"
-            self.driver.get(base_url)
-            WebDriverWait(self.driver, TIMEOUT).until(
-                EC.presence_of_element_located((By.TAG_NAME, "body"))
-            )
-            soup = BeautifulSoup(self.driver.page_source, "html.parser")
-            h2_tag = soup.find("h2", string=["Illustrations and Manga", "イラスト・マンガ"])
-            if h2_tag and (span_tag := h2_tag.parent.find("span")) and span_tag.text:
-                count_text = span_tag.text.replace(",", "").strip()
-                if count_text.isdigit():
-                    self.target_count = int(count_text)
-                    logger.info(f"User found. Total artworks available: {self.target_count}")
-                    self.artwork_label.config(text=f"Illustrations and Manga: {self.target_count}")
-                else:
-                    logger.error(f"Cannot parse artwork count: '{count_text}' is not a valid number.")
-                    self.target_count = 0
-                    self.total_pages = 0
-                    self.artwork_label.config(text=f"Illustrations and Manga: 0")
-                    self.page_label.config(text="of 0 pages")
-                    self.page_combo.config(state="normal")
-                    self.page_combo["values"] = []
-                    self.page_combo.set("")
-                    self.fetch_complete = False
-                    return
-            else:
-                self.target_count = 0
-                self.total_pages = 0
-                logger.error("Invalid User ID or no artworks found.")
-                self.artwork_label.config(text=f"Illustrations and Manga: 0")
-                self.page_label.config(text="of 0 pages")
-                self.page_combo.config(state="normal")
-                self.page_combo["values"] = []
-                self.page_combo.set("")
-                self.fetch_complete = False
-                return
+            pass
 
-            artworks_url = f"https://www.pixiv.net/en/users/{self.user_id}/artworks?p=1"
-            self.driver.get(artworks_url)
-            WebDriverWait(self.driver, TIMEOUT).until(EC.presence_of_element_located((By.XPATH, "//a[contains(@href, '/artworks/')]")))
-            self.driver.execute_script("window.scrollTo(0, document.body.scrollHeight);")
-            time.sleep(2)
-            soup = BeautifulSoup(self.driver.page_source, "html.parser")
-            artwork_links = soup.find_all("a", href=re.compile(r"(/en)?/artworks/\d+$"))
-            artwork_ids = set(re.search(r"/artworks/(\d+)$", link["href"]).group(1) for link in artwork_links)
-            artworks_per_page = len(artwork_ids)
-            logger.info(f"Page 1: Found {artworks_per_page} unique artworks")
-            self.total_pages = math.ceil(self.target_count / artworks_per_page) if artworks_per_page > 0 else 1
-            logger.info(f"Calculated {self.total_pages} pages of artworks.")
+    def clear_url(self):
+        self.url_entry.delete(0, tk.END)
 
-            self.page_label.config(text=f"of {self.total_pages} pages")
-            self.page_combo.config(state="normal")
-            self.page_combo["values"] = [str(i) for i in range(1, self.total_pages + 1)]
-            self.page_combo.set("1")
-            self.fetch_complete = True
-        except (TimeoutException, WebDriverException, InvalidSessionIdException) as e:
-            logger.error(f"Search interrupted: {str(e)}")
-            error_occurred = True
-            self.fetch_complete = False
-            self.target_count = 0
-            self.total_pages = 0
-            self.artwork_label.config(text=f"Illustrations and Manga: 0")
-            self.page_label.config(text="of 0 pages")
-            self.page_combo.config(state="normal")
-            self.page_combo["values"] = []
-            self.page_combo.set("")
-        except Exception as e:
-            logger.error(f"Unexpected error fetching artwork count or pages: {str(e)}")
-            error_occurred = True
-            self.fetch_complete = False
-            self.target_count = 0
-            self.total_pages = 0
-            self.artwork_label.config(text=f"Illustrations and Manga: 0")
-            self.page_label.config(text="of 0 pages")
-            self.page_combo.config(state="normal")
-            self.page_combo["values"] = []
-            self.page_combo.set("")
+    def paste_url(self):
+        try:
+            clipboard_text = self.root.clipboard_get()
+            self.url_entry.delete(0, tk.END)
+            self.url_entry.insert(0, clipboard_text)
+        except tk.TclError:
+            pass
+
+    def fetch_artwork_count_and_pages(self):
+        try:
+            self.lookup_user()
         finally:
-            if self.driver and self.is_session_valid(self.driver):
-                if error_occurred or self.is_headless:
-                    self.driver.quit()
-                    self.driver = None
-            self.search_button.config(state="normal")
-            self.download_url_button.config(state="normal")
-            self.download_button.config(state="normal" if self.fetch_complete and self.target_count > 0 else "disabled")
-            self.download_page_button.config(state="normal" if self.fetch_complete and self.target_count > 0 else "disabled")
+            self.show_search_result()
+
+    def show_search_result(self):
+        self.artwork_label.config(text=f"Illustrations and Manga: {self.target_count}")
+        self.page_label.config(text=f"of {self.total_pages} pages")
+        self.page_combo.config(state="normal")
+        self.page_combo["values"] = [str(i) for i in range(1, self.total_pages + 1)] if self.fetch_complete else []
+        self.page_combo.set("1" if self.fetch_complete and self.total_pages else "")
+        self.search_button.config(state="normal")
+        self.download_url_button.config(state="normal")
+        self.download_button.config(state="normal" if self.fetch_complete and self.target_count > 0 else "disabled")
+        self.retry_failed_button.config(state="normal" if self.fetch_complete and self.target_count > 0 else "disabled")
+        self.download_page_button.config(state="normal" if self.fetch_complete and self.target_count > 0 else "disabled")
 
     def start_download(self):
-        self.stop_download = False
+        self.token = CancelToken()
         self.download_button.config(state="disabled")
+        self.retry_failed_button.config(state="disabled")
         self.download_page_button.config(state="disabled")
         self.download_url_button.config(state="disabled")
         self.stop_button.config(state="normal")
@@ -607,17 +2896,19 @@ class PixivDownloaderApp:
         self.progress_bar["value"] = 0
         self.save_folder = os.path.join(save_folder_base, f"pixiv_{self.user_id}_images")
         os.makedirs(self.save_folder, exist_ok=True)
-        self.driver = self.restart_driver(self.driver, force_headless=None)
-        if not self.driver:
-            logger.error("Download aborted: Could not initialize browser.")
-            self.reset_ui()
-            return
-        threading.Thread(target=self.download_all, daemon=True).start()
+        if not self.artwork_ids:
+            self.driver = self.restart_driver(self.driver, force_headless=None)
+            if not self.driver:
+                logger.error("Download aborted: Could not initialize browser.")
+                self.reset_ui()
+                return
+        threading.Thread(target=self.download_all, args=(self.sync_var.get(),), daemon=True).start()
 
     def start_download_page(self):
         page_str = self.page_combo.get()
-        self.stop_download = False
+        self.token = CancelToken()
         self.download_button.config(state="disabled")
+        self.retry_failed_button.config(state="disabled")
         self.download_page_button.config(state="disabled")
         self.download_url_button.config(state="disabled")
         self.stop_button.config(state="normal")
@@ -626,11 +2917,12 @@ class PixivDownloaderApp:
         self.progress_bar["value"] = 0
         self.save_folder = os.path.join(save_folder_base, f"pixiv_{self.user_id}_images")
         os.makedirs(self.save_folder, exist_ok=True)
-        self.driver = self.restart_driver(self.driver, force_headless=None)
-        if not self.driver:
-            logger.error("Download aborted: Could not initialize browser.")
-            self.reset_ui()
-            return
+        if not self.artwork_ids:
+            self.driver = self.restart_driver(self.driver, force_headless=None)
+            if not self.driver:
+                logger.error("Download aborted: Could not initialize browser.")
+                self.reset_ui()
+                return
         threading.Thread(target=self.download_page, args=(int(page_str),), daemon=True).start()
 
     def start_download_url(self):
@@ -640,8 +2932,9 @@ class PixivDownloaderApp:
             self.download_url_button.config(state="normal")
             return
 
-        self.stop_download = False
+        self.token = CancelToken()
         self.download_button.config(state="disabled")
+        self.retry_failed_button.config(state="disabled")
         self.download_page_button.config(state="disabled")
         self.download_url_button.config(state="disabled")
         self.stop_button.config(state="normal")
@@ -651,21 +2944,46 @@ class PixivDownloaderApp:
         artwork_id = artwork_url.split('/')[-1]
         self.save_folder = os.path.join(save_folder_base, f"pixiv_artwork_{artwork_id}_images")
         os.makedirs(self.save_folder, exist_ok=True)
-        self.driver = self.restart_driver(self.driver, force_headless=not self.show_browser_var.get())
-        if not self.driver:
-            logger.error("Download aborted: Could not initialize browser.")
-            self.reset_ui()
-            return
-        
-        self.driver.get(artwork_url)
+        if not self.use_api_var.get():
+            self.driver = self.restart_driver(self.driver, force_headless=not self.show_browser_var.get())
+            if not self.driver:
+                logger.error("Download aborted: Could not initialize browser.")
+                self.reset_ui()
+                return
+
+            self.driver.get(artwork_url)
         threading.Thread(target=self.download_url, args=(artwork_url,), daemon=True).start()
 
+    def start_retry_failed(self):
+        self.save_folder = os.path.join(save_folder_base, f"pixiv_{self.user_id}_images")
+        entries = list(FailureLog(self.save_folder).entries.values())
+        if not entries:
+            logger.info(f"No failed artworks recorded for User ID {self.user_id}.")
+            return
+        self.token = CancelToken()
+        self.download_button.config(state="disabled")
+        self.retry_failed_button.config(state="disabled")
+        self.download_page_button.config(state="disabled")
+        self.download_url_button.config(state="disabled")
+        self.stop_button.config(state="normal")
+        self.search_button.config(state="disabled")
+        self.verify_cookies_button.config(state="disabled")
+        self.progress_bar["value"] = 0
+        if not self.use_api_var.get():
+            self.driver = self.restart_driver(self.driver, force_headless=None)
+            if not self.driver:
+                logger.error("Download aborted: Could not initialize browser.")
+                self.reset_ui()
+                return
+        threading.Thread(target=self.download_failed, args=(entries,), daemon=True).start()
+
     def stop_download_process(self):
-        self.stop_download = True
+        self.token.cancel()
         self.root.after(1000, self.reset_ui)
 
     def reset_ui(self):
         self.download_button.config(state="normal" if self.fetch_complete else "disabled")
+        self.retry_failed_button.config(state="normal" if self.fetch_complete else "disabled")
         self.download_page_button.config(state="normal" if self.fetch_complete else "disabled")
         self.download_url_button.config(state="normal" if self.cookies_valid else "disabled")
         self.stop_button.config(state="disabled")
@@ -673,503 +2991,42 @@ class PixivDownloaderApp:
         self.verify_cookies_button.config(state="normal" if self.cookies_valid else "disabled")
         self.progress_bar["value"] = 0
 
-    def download_all(self):
-        self.start_time = time.time()
-        self.processed_count = 0
-        self.downloaded_count = 0
-        self.skipped_count = 0
-        if not self.driver or not self.is_session_valid(self.driver):
-            logger.error("Browser session invalid or closed. Aborting download.")
-            self.root.after(0, self.reset_ui)
-            return
-        session_valid = [True]
-        artwork_links_seen = set()
-        failed_urls = []
-        failed_downloads = []
-
-        try:
-            artworks_url = f"https://www.pixiv.net/en/users/{self.user_id}/artworks?p=1"
-            self.driver.get(artworks_url)
-            WebDriverWait(self.driver, TIMEOUT).until(EC.presence_of_element_located((By.XPATH, "//a[contains(@href, '/artworks/')]")))
-            self.driver.execute_script("window.scrollTo(0, document.body.scrollHeight);")
-            time.sleep(2)
-            soup = BeautifulSoup(self.driver.page_source, "html.parser")
-            artwork_links = soup.find_all("a", href=re.compile(r"(/en)?/artworks/\d+$"))
-            artwork_ids = set(re.search(r"/artworks/(\d+)$", link["href"]).group(1) for link in artwork_links)
-            artworks_per_page = len(artwork_ids)
-            total_pages = math.ceil(self.target_count / artworks_per_page) if artworks_per_page > 0 else 1
-            logger.info(f"Calculated {total_pages} pages of artworks.")
-
-            page_num = 1
-            while page_num <= total_pages and session_valid[0] and not self.stop_download:
-                page_url = f"https://www.pixiv.net/en/users/{self.user_id}/artworks?p={page_num}"
-                if not self.is_session_valid(self.driver):
-                    logger.info(f"Stopping process on Page {page_num}: Browser window closed")
-                    break
-                try:
-                    self.driver.get(page_url)
-                    WebDriverWait(self.driver, TIMEOUT).until(EC.presence_of_element_located((By.XPATH, "//a[contains(@href, '/artworks/')]")))
-                    self.driver.execute_script("window.scrollTo(0, document.body.scrollHeight);")
-                    time.sleep(2)
-                except (TimeoutException, WebDriverException, InvalidSessionIdException):
-                    logger.info(f"Stopping process on Page {page_num}: Browser window closed or timed out")
-                    break
-
-                if self.stop_download:
-                    break
-
-                soup = BeautifulSoup(self.driver.page_source, "html.parser")
-                page_linked = set()
-                for link in soup.find_all("a", href=re.compile(r"(/en)?/artworks/\d+$")):
-                    full_url = "https://www.pixiv.net" + link["href"]
-                    artwork_id = re.search(r"/artworks/(\d+)$", link["href"]).group(1)
-                    full_url_normalized = f"https://www.pixiv.net/en/artworks/{artwork_id}"
-                    if full_url_normalized not in artwork_links_seen:
-                        page_linked.add(full_url_normalized)
-                        artwork_links_seen.add(full_url_normalized)
-                logger.info(f"Page {page_num}: Found {len(page_linked)} new artworks (Total so far: {len(artwork_links_seen)})")
-
-                page_progress = 0
-                page_start_time = time.time()
-                processed_urls = set()
-                for artwork_url in page_linked:
-                    if not session_valid[0] or self.stop_download:
-                        for remaining_url in page_linked - processed_urls:
-                            failed_urls.append((remaining_url, page_num, "Session interrupted"))
-                        break
-
-                    image_urls = self.get_image_urls(artwork_url, self.driver, session_valid)
-                    if not image_urls:
-                        if not session_valid[0]:
-                            failed_urls.append((artwork_url, page_num, "Session interrupted"))
-                            for remaining_url in page_linked - processed_urls - {artwork_url}:
-                                failed_urls.append((remaining_url, page_num, "Session interrupted"))
-                            break
-                        failed_urls.append((artwork_url, page_num, "Failed to extract image URLs"))
-                        processed_urls.add(artwork_url)
-                        continue
-
-                    all_skipped = True
-                    for image_url in image_urls:
-                        if self.stop_download:
-                            break
-                        filename = image_url.split("/")[-1]
-                        save_path = os.path.join(self.save_folder, filename)
-                        if os.path.exists(save_path) and os.path.getsize(save_path) > 0:
-                            logger.info(f"Skipped: {save_path} already exists")
-                            continue
-
-                        all_skipped = False
-                        for attempt in range(5):
-                            if self.stop_download:
-                                break
-                            try:
-                                image_data = self.session.get(image_url, headers=headers, timeout=10).content
-                                with open(save_path, "wb") as file:
-                                    file.write(image_data)
-                                logger.info(f"Downloaded: {save_path}")
-                                break
-                            except Exception as e:
-                                if attempt == 4:
-                                    failed_downloads.append((image_url, artwork_url, page_num, str(e)))
-                                time.sleep(random.uniform(1, 3))
-
-                    if self.stop_download:
-                        for remaining_url in page_linked - processed_urls:
-                            failed_urls.append((remaining_url, page_num, "Session interrupted"))
-                        break
-
-                    self.processed_count += 1
-                    processed_urls.add(artwork_url)
-                    if all_skipped:
-                        self.skipped_count += 1
-                    else:
-                        self.downloaded_count += 1
-
-                    page_progress += 1
-                    elapsed = time.time() - page_start_time
-                    elapsed_str = f"{int(elapsed // 60):02d}:{int(elapsed % 60):02d}"
-                    percent = int((page_progress / len(page_linked)) * 100)
-                    speed = elapsed / page_progress if page_progress > 0 else 0
-                    logger.info(f"Downloading Page {page_num}: {percent}% {page_progress}/{len(page_linked)} [{elapsed_str}, {speed:.2f}s/artwork]")
-                    logger.info(f"Processed artworks: {self.processed_count}/{self.target_count}")
-                    self.progress_bar["value"] = (self.processed_count / self.target_count) * 100
-                    self.root.update_idletasks()
-
-                page_num += 1
-
-        except Exception as e:
-            logger.error(f"Unexpected error in download_all: {str(e)}")
-        finally:
-            if failed_urls:
-                logger.info("Failed artworks:")
-                for url, page, error in failed_urls:
-                    logger.info(f"  {url} (Page {page}): {error}")
-            if failed_downloads:
-                logger.info("Failed downloads:")
-                for image_url, artwork_url, page, error in failed_downloads:
-                    logger.info(f"  {image_url} from {artwork_url} (Page {page}): {error}")
-            self.print_summary(self.processed_count, self.target_count, self.downloaded_count, self.skipped_count, self.start_time)
-            if self.driver and self.is_session_valid(self.driver):
-                try:
-                    self.driver.quit()
-                except Exception:
-                    pass
-            self.driver = None
-            self.root.after(0, self.reset_ui)
-
-    def download_page(self, page_num):
-        self.start_time = time.time()
-        self.processed_count = 0
-        self.downloaded_count = 0
-        self.skipped_count = 0
-        if not self.driver or not self.is_session_valid(self.driver):
-            logger.error("Browser session invalid or closed. Aborting download.")
-            self.root.after(0, self.reset_ui)
-            return
-        session_valid = [True]
-        artwork_links_seen = set()
-        failed_urls = []
-        failed_downloads = []
-
-        try:
-            artworks_url = f"https://www.pixiv.net/en/users/{self.user_id}/artworks?p={page_num}"
-            if not self.stop_download and session_valid[0]:
-                try:
-                    self.driver.get(artworks_url)
-                    WebDriverWait(self.driver, TIMEOUT).until(EC.presence_of_element_located((By.XPATH, "//a[contains(@href, '/artworks/')]")))
-                except (TimeoutException, WebDriverException, InvalidSessionIdException):
-                    logger.info(f"Stopping process on Page {page_num}: Browser window closed or timed out")
-                    session_valid[0] = False
-                    self.root.after(0, self.reset_ui)
-                    return
-                if self.stop_download:
-                    logger.info(f"Session interrupted. Stopping process on Page {page_num}.")
-                    self.root.after(0, self.reset_ui)
-                    return
-
-            if self.stop_download:
-                logger.info(f"Session interrupted. Stopping process on Page {page_num}.")
-                return
-
-            self.driver.execute_script("window.scrollTo(0, document.body.scrollHeight);")
-            time.sleep(2)
-            soup = BeautifulSoup(self.driver.page_source, "html.parser")
-            page_linked = set()
-            for link in soup.find_all("a", href=re.compile(r"(/en)?/artworks/\d+$")):
-                full_url = "https://www.pixiv.net" + link["href"]
-                artwork_id = re.search(r"/artworks/(\d+)$", link["href"]).group(1)
-                full_url_normalized = f"https://www.pixiv.net/en/artworks/{artwork_id}"
-                if full_url_normalized not in artwork_links_seen:
-                    page_linked.add(full_url_normalized)
-                    artwork_links_seen.add(full_url_normalized)
-            logger.info(f"Page {page_num}: Found {len(page_linked)} new artworks (Total so far: {len(artwork_links_seen)})")
-
-            page_progress = 0
-            page_start_time = time.time()
-            processed_urls = set()
-            for artwork_url in page_linked:
-                if not session_valid[0] or self.stop_download:
-                    for remaining_url in page_linked - processed_urls:
-                        failed_urls.append((remaining_url, page_num, "Session interrupted"))
-                    break
-
-                image_urls = self.get_image_urls(artwork_url, self.driver, session_valid)
-                if not image_urls:
-                    if not session_valid[0]:
-                        failed_urls.append((artwork_url, page_num, "Session interrupted"))
-                        for remaining_url in page_linked - processed_urls - {artwork_url}:
-                            failed_urls.append((remaining_url, page_num, "Session interrupted"))
-                        break
-                    failed_urls.append((artwork_url, page_num, "Failed to extract image URLs"))
-                    processed_urls.add(artwork_url)
-                    continue
-
-                all_skipped = True
-                for image_url in image_urls:
-                    if self.stop_download:
-                        break
-                    filename = image_url.split("/")[-1]
-                    save_path = os.path.join(self.save_folder, filename)
-                    if os.path.exists(save_path) and os.path.getsize(save_path) > 0:
-                        logger.info(f"Skipped: {save_path} already exists")
-                        continue
-
-                    all_skipped = False
-                    for attempt in range(5):
-                        if self.stop_download:
-                            break
-                        try:
-                            image_data = self.session.get(image_url, headers=headers, timeout=10).content
-                            with open(save_path, "wb") as file:
-                                file.write(image_data)
-                            logger.info(f"Downloaded: {save_path}")
-                            break
-                        except Exception as e:
-                            if attempt == 4:
-                                failed_downloads.append((image_url, artwork_url, page_num, str(e)))
-                            time.sleep(random.uniform(1, 3))
-
-                if self.stop_download:
-                    for remaining_url in page_linked - processed_urls:
-                        failed_urls.append((remaining_url, page_num, "Session interrupted"))
-                    break
-
-                self.processed_count += 1
-                processed_urls.add(artwork_url)
-                if all_skipped:
-                    self.skipped_count += 1
-                else:
-                    self.downloaded_count += 1
-
-                page_progress += 1
-                elapsed = time.time() - page_start_time
-                elapsed_str = f"{int(elapsed // 60):02d}:{int(elapsed % 60):02d}"
-                percent = int((page_progress / len(page_linked)) * 100)
-                speed = elapsed / page_progress if page_progress > 0 else 0
-                logger.info(f"Downloading Page {page_num}: {percent}% {page_progress}/{len(page_linked)} [{elapsed_str}, {speed:.2f}s/artwork]")
-                self.progress_bar["value"] = (self.processed_count / len(page_linked)) * 100
-                self.root.update_idletasks()
-
-        except Exception as e:
-            logger.error(f"Unexpected error in download_page: {str(e)}")
-        finally:
-            if failed_urls:
-                logger.info("Failed artworks:")
-                for url, page, error in failed_urls:
-                    logger.info(f"  {url} (Page {page}): {error}")
-            if failed_downloads:
-                logger.info("Failed downloads:")
-                for image_url, artwork_url, page, error in failed_downloads:
-                    logger.info(f"  {image_url} from {artwork_url} (Page {page}): {error}")
-            self.print_summary(self.processed_count, len(page_linked) if 'page_linked' in locals() else 0, self.downloaded_count, self.skipped_count, self.start_time)
-            if self.driver and self.is_session_valid(self.driver):
-                try:
-                    self.driver.quit()
-                except Exception:
-                    pass
-            self.driver = None
-            self.root.after(0, self.reset_ui)
-
-    def download_url(self, artwork_url):
-        self.start_time = time.time()
-        self.processed_count = 0
-        self.downloaded_count = 0
-        self.skipped_count = 0
-        if not self.driver or not self.is_session_valid(self.driver):
-            logger.error("Browser session invalid or closed. Aborting download.")
+    def on_engine_event(self, event):
+        # Engine events arrive on worker threads; widgets are only touched from the Tk loop.
+        if event["event"] == "artwork":
+            percent = event["percent"]
+            self.root.after(0, lambda: self.progress_bar.config(value=percent))
+        elif event["event"] == "concurrency":
+            text = f"Concurrency: {event['state'] or '-'}"
+            self.root.after(0, lambda: self.concurrency_label.config(text=text))
+        elif event["event"] == "run_finished":
             self.root.after(0, self.reset_ui)
-            return
-        session_valid = [True]
-        failed_urls = []
-        failed_downloads = []
-
-        try:
-            logger.info(f"Processing artwork URL: {artwork_url}")
-            if not self.stop_download and session_valid[0]:
-                image_urls = self.get_image_urls(artwork_url, self.driver, session_valid)
-                if not image_urls:
-                    if not session_valid[0]:
-                        failed_urls.append((artwork_url, 1, "Session interrupted"))
-                        logger.info("Session interrupted. Stopping process.")
-                    else:
-                        failed_urls.append((artwork_url, 1, "Failed to extract image URLs"))
-                    return
-
-                all_skipped = True
-                for image_url in image_urls:
-                    if self.stop_download:
-                        break
-                    filename = image_url.split("/")[-1]
-                    save_path = os.path.join(self.save_folder, filename)
-                    if os.path.exists(save_path) and os.path.getsize(save_path) > 0:
-                        logger.info(f"Skipped: {save_path} already exists")
-                        continue
-
-                    all_skipped = False
-                    for attempt in range(5):
-                        if self.stop_download:
-                            break
-                        try:
-                            image_data = self.session.get(image_url, headers=headers, timeout=10).content
-                            with open(save_path, "wb") as file:
-                                file.write(image_data)
-                            logger.info(f"Downloaded: {save_path}")
-                            break
-                        except Exception as e:
-                            if attempt == 4:
-                                failed_downloads.append((image_url, artwork_url, 1, str(e)))
-                            time.sleep(random.uniform(1, 3))
-
-                if self.stop_download:
-                    failed_urls.append((artwork_url, 1, "Session interrupted"))
-                    logger.info("Session interrupted. Stopping process.")
-                    return
 
-                self.processed_count += 1
-                if all_skipped:
-                    self.skipped_count += 1
-                else:
-                    self.downloaded_count += 1
-
-                elapsed = time.time() - self.start_time
-                elapsed_str = f"{int(elapsed // 60):02d}:{int(elapsed % 60):02d}"
-                logger.info(f"Processed artwork: 100% 1/1 [{elapsed_str}]")
-                self.progress_bar["value"] = 100
-                self.root.update_idletasks()
+    def on_closing(self):
+        self.token.cancel()
+        time.sleep(1)
 
-        except (TimeoutException, WebDriverException, InvalidSessionIdException) as e:
-            logger.info(f"Stopping process for {artwork_url}: {str(e)}")
-            session_valid[0] = False
-        except Exception as e:
-            logger.error(f"Unexpected error in download_url: {str(e)}")
-            logger.info("Session interrupted. Stopping process.")
-        finally:
-            if failed_urls:
-                logger.info("Failed artworks:")
-                for url, page, error in failed_urls:
-                    logger.info(f"  {url}: {error}")
-            if failed_downloads:
-                logger.info("Failed downloads:")
-                for image_url, artwork_url, page, error in failed_downloads:
-                    logger.info(f"  {image_url} from {artwork_url}: {error}")
-            self.print_summary(self.processed_count, 1, self.downloaded_count, self.skipped_count, self.start_time)
-            if self.driver and self.is_session_valid(self.driver):
-                try:
-                    self.driver.quit()
-                except Exception:
-                    pass
-            self.driver = None
-            self.root.after(0, self.reset_ui)
+        if self.checkpoint:
+            try:
+                self.checkpoint.save()
+            except Exception as e:
+                logger.error(f"Error saving checkpoint: {e}")
 
-    def restart_driver(self, existing_driver=None, force_headless=None):
-        # If force_headless is None, respect the show_browser_var toggle
-        if force_headless is None:
-            desired_headless = not self.show_browser_var.get()
-        else:
-            # If force_headless is explicitly set, it takes precedence
-            desired_headless = force_headless
-        
-        if existing_driver and self.is_session_valid(existing_driver):
-            if self.is_headless == desired_headless:
-                return existing_driver
-            else:
-                try:
-                    existing_driver.quit()
-                except Exception:
-                    pass
-        
-        options = webdriver.ChromeOptions()
-        options.add_argument('--log-level=3')
-        self.is_headless = desired_headless
-        if self.is_headless:
-            options.add_argument('--headless=new')
-        
         try:
-            with redirect_stdout(StringIO()):
-                new_driver = webdriver.Chrome(service=Service(ChromeDriverManager().install()), options=options)
-            new_driver.get("https://www.pixiv.net")
-            for cookie in self.cookies:
-                try:
-                    new_driver.add_cookie(cookie)
-                except Exception:
-                    logger.error("Browser window closed during cookie setup.")
-                    new_driver.quit()
-                    return None
-            return new_driver
+            self.session.close()
         except Exception as e:
-            logger.exception(f"Unexpected error initializing ChromeDriver: {e}")
-            return None
-
-    def is_session_valid(self, driver):
-        try:
-            driver.current_url
-            return True
-        except (InvalidSessionIdException, NoSuchWindowException):
-            return False
-
-    def get_image_urls(self, artwork_url, driver, session_valid_ref):
-        for attempt in range(3):
-            if self.stop_download or not self.is_session_valid(driver):
-                logger.info(f"Stopping process for {artwork_url}: Session interrupted (window closed or stopped)")
-                session_valid_ref[0] = False
-                return []
+            logger.error(f"Error closing requests session: {e}")
 
+        if self.transport:
             try:
-                driver.get(artwork_url)
-                WebDriverWait(driver, TIMEOUT).until(
-                    lambda d: d.find_elements(By.CSS_SELECTOR, "div[aria-label='Preview'], div[aria-label='プレビュー']") or 
-                            d.find_elements(By.TAG_NAME, "img")
-                )
-                time.sleep(2)
-                page_source = driver.page_source
-                soup = BeautifulSoup(page_source, "html.parser")
-
-                page_count = 1
-                if preview_div := soup.find("div", {"aria-label": ["Preview", "プレビュー"]}):
-                    spans = preview_div.find_all("span")
-                    for span in spans:
-                        if "/" in span.text:
-                            page_count = int(span.text.split("/")[1])
-                            logger.info(f"Detected {page_count} pages from Preview div for {artwork_url}")
-                            break
-                    else:
-                        logger.info(f"No page count found in Preview div spans for {artwork_url}")
-
-                if img_match := re.search(r"https://i\.pximg\.net/img-original/img/\d{4}/\d{2}/\d{2}/\d{2}/\d{2}/\d{2}/(\d+_p\d+\.(png|jpg|jpeg|gif))", page_source):
-                    base_url = img_match.group(0).rsplit("_p", 1)[0]
-                    ext = img_match.group(2).split(".")[-1]
-                else:
-                    illust_id = artwork_url.split("/")[-1]
-                    if meta_tag := soup.find("meta", property="og:image"):
-                        if "i.pximg.net" in meta_tag["content"]:
-                            if date_match := re.search(r"img/(\d{4}/\d{2}/\d{2}/\d{2}/\d{2}/\d{2})", meta_tag["content"]):
-                                date_path = date_match.group(1)
-                                base_url = f"https://i.pximg.net/img-original/img/{date_path}/{illust_id}"
-                                ext = "png"
-                            else:
-                                logger.error(f"No date path found in og:image for {artwork_url}")
-                                return []
-                        else:
-                            logger.debug(f"og:image found but no usable pximg.net URL for {artwork_url}")
-                            return []
-                    else:
-                        logger.error(f"No valid image URL pattern found for {artwork_url}")
-                        return []
-
-                image_urls = [f"{base_url}_p{i}.{ext}" for i in range(page_count)]
-                logger.info(f"Generated {len(image_urls)} image URLs for {artwork_url}")
-                return image_urls
-
-            except (TimeoutException, WebDriverException, InvalidSessionIdException) as e:
-                if isinstance(e, InvalidSessionIdException) or isinstance(e, NoSuchWindowException):
-                    logger.info(f"Stopping process for {artwork_url}: Browser window closed")
-                    session_valid_ref[0] = False
-                    return []
-                if attempt < 2:
-                    logger.info(f"Retrying {artwork_url} (attempt {attempt + 2}/3): {str(e)}")
-                    time.sleep(random.uniform(2, 4))
-                    continue
-                logger.error(f"Failed to get URLs for {artwork_url} after 3 attempts: {str(e)}")
-                return []
+                self.transport.close()
             except Exception as e:
-                logger.error(f"Unexpected error for {artwork_url}: {str(e)}")
-                session_valid_ref[0] = False
-                return []
-
-    def print_summary(self, processed_count, target_count, downloaded_count, skipped_count, start_time):
-        total_time = time.time() - start_time
-        time_str = f"{int(total_time // 60):02d}:{int(total_time % 60):02d}"
-        logger.info(f"Total artworks processed: {processed_count}/{target_count} ({downloaded_count} downloaded, {skipped_count} skipped) in {time_str}")
-
-    def on_closing(self):
-        self.stop_download = True
-        time.sleep(1)
+                logger.error(f"Error closing async transport: {e}")
 
         try:
-            self.session.close()
+            self.index.close()
         except Exception as e:
-            logger.error(f"Error closing requests session: {e}")
+            logger.error(f"Error closing download index: {e}")
 
         if self.driver:
             try:
@@ -1186,24 +3043,234 @@ class PixivDownloaderApp:
         logger.info("")
         if self.log_handler in logger.handlers:
             logger.removeHandler(self.log_handler)
+            self.log_handler.close()
         self.root.destroy()
 
 class TextHandler(logging.Handler):
-    def __init__(self, text_widget):
+    # Records from any thread go onto a queue; the Tk loop drains it every interval in one widget update
+    # and trims the widget to the last max_lines lines.
+    def __init__(self, text_widget, max_lines=LOG_MAX_LINES, interval=LOG_FLUSH_MS):
         super().__init__()
         self.text_widget = text_widget
+        self.max_lines = max_lines
+        self.interval = interval
+        self.queue = queue.SimpleQueue()
+        self.closed = False
+        self.text_widget.after(self.interval, self.drain)
 
     def emit(self, record):
         try:
-            msg = self.format(record)
-            self.text_widget.config(state="normal")
-            self.text_widget.insert(tk.END, msg + "\n")
-            self.text_widget.see(tk.END)
-            self.text_widget.config(state="disabled")
-        except tk.TclError:
-            pass
+            self.queue.put(self.format(record))
+        except Exception:
+            self.handleError(record)
+
+    def drain(self):
+        lines = collections.deque(maxlen=self.max_lines)
+        while True:
+            try:
+                lines.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+        if lines:
+            try:
+                self.text_widget.config(state="normal")
+                self.text_widget.insert(tk.END, "\n".join(lines) + "\n")
+                excess = int(self.text_widget.index("end-1c").split(".")[0]) - 1 - self.max_lines
+                if excess > 0:
+                    self.text_widget.delete("1.0", f"{excess + 1}.0")
+                self.text_widget.see(tk.END)
+                self.text_widget.config(state="disabled")
+            except tk.TclError:
+                return
+        if not self.closed:
+            self.text_widget.after(self.interval, self.drain)
+
+    def close(self):
+        self.closed = True
+        super().close()
+
+def read_targets(targets, path=None):
+    # User IDs and artwork URLs from the command line and an optional file (one per line, # starts a comment), in order, without duplicates.
+    if path:
+        with open(path, "r", encoding="utf-8") as f:
+            targets = list(targets) + [line.split("#", 1)[0].strip() for line in f]
+    valid = []
+    for target in targets:
+        if not target:
+            continue
+        if target.isdigit() or re.match(r"https://www\.pixiv\.net(/en)?/artworks/\d+", target):
+            valid.append(target)
+        else:
+            logger.error(f"Ignoring {target}: not a user ID or pixiv artwork URL.")
+    return list(dict.fromkeys(valid))
+
+def run_batch_target(target, args, active):
+    downloader = PixivDownloader()
+    downloader.use_api_var.set(not args.no_api)
+    downloader.lean_var.set(not args.full_browser)
+    downloader.enumerate_var.set(args.enumerate)
+    downloader.async_var.set(args.async_transfers)
+    downloader.http2_var.set(args.http2)
+    downloader.connections_var.set(args.connections)
+    downloader.rate_limit_var.set(args.rate_limit)
+    downloader.byte_limit_var.set(args.byte_limit)
+    downloader.workers_var.set(args.workers)
+    downloader.browsers_var.set(args.browsers)
+    token = CancelToken()
+    active.append(token)
+    try:
+        if not downloader.load_cookie_file():
+            logger.error(f"{target}: no cookie file found. Save cookies in the GUI first.")
+            return False, downloader
+        return downloader.download(target, sync=args.sync, retry_failed=args.retry_failed, token=token), downloader
+    except Exception as e:
+        logger.error(f"{target}: {str(e)}")
+        return False, downloader
+    finally:
+        downloader.close()
+
+def run_batch(args):
+    targets = read_targets(args.targets, args.file)
+    if not targets:
+        logger.error("No user IDs or artwork URLs given.")
+        return 2
+    start_time = time.time()
+    active = []
+    results = {}
+    interrupted = False
+    logger.info(f"Batch of {len(targets)} targets, {args.parallel} at a time.")
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, args.parallel)) as executor:
+        futures = {executor.submit(run_batch_target, target, args, active): target for target in targets}
+        pending = set(futures)
+        while pending:
+            try:
+                done, pending = concurrent.futures.wait(pending, timeout=0.5)
+            except KeyboardInterrupt:
+                logger.info("Interrupted, stopping all downloads.")
+                interrupted = True
+                for future in pending:
+                    future.cancel()
+                for token in active:
+                    token.cancel()
+                continue
+            for future in done:
+                results[futures[future]] = future.result() if not future.cancelled() else (False, None)
+    succeeded = 0
+    for target in targets:
+        ok, downloader = results.get(target, (False, None))
+        succeeded += ok
+        if downloader:
+            logger.info(f"{'OK  ' if ok else 'FAIL'} {target}: {downloader.processed_count} processed "
+                        f"({downloader.downloaded_count} downloaded, {downloader.skipped_count} skipped), {downloader.failed_count} failed")
+        else:
+            logger.info(f"FAIL {target}: not run")
+    total_time = time.time() - start_time
+    logger.info(f"Batch finished: {succeeded}/{len(targets)} targets succeeded in {int(total_time // 60):02d}:{int(total_time % 60):02d}")
+    if interrupted:
+        return 130
+    return 0 if succeeded == len(targets) else 1
+
+def benchmark_transports(url, count=BENCHMARK_REQUESTS, workers=DOWNLOAD_WORKERS):
+    # Download url count times through the worker threads + requests session and through the async transport.
+    # Point it at an image on a local server (e.g. python -m http.server) so the network does not dominate.
+    downloader = PixivDownloader()
+    downloader.rate_limiter = SharedRateLimiter(requests_per_sec=0)
+    downloader.async_var.set(True)
+    modes = ["session"] + (["async"] if httpx else []) + (["http2"] if httpx and h2 and url.startswith("https://") else [])
+    if not httpx:
+        logger.info("httpx is not installed; only the session path is measured.")
+    results = {}
+    try:
+        for mode in modes:
+            downloader.http2_var.set(mode == "http2")
+            downloader.connection_baseline = downloader.session_connection_stats()
+            peak_threads = [threading.active_count()]
+            with tempfile.TemporaryDirectory() as folder:
+                save_paths = [os.path.join(folder, f"{i}.img") for i in range(count)]
+                start = time.perf_counter()
+                if mode == "session":
+                    def fetch(save_path):
+                        try:
+                            return downloader.stream_to_file(url, save_path)
+                        except Exception as e:
+                            return e
+                        finally:
+                            peak_threads[0] = max(peak_threads[0], threading.active_count())
+                    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+                        outcomes = list(executor.map(fetch, save_paths))
+                else:
+                    transport = downloader.get_transport()
+                    async def fetch(save_path):
+                        # Sampled after each download, once its asyncio.to_thread calls have started their executor threads.
+                        try:
+                            return await downloader.stream_to_file_async(url, save_path)
+                        finally:
+                            peak_threads[0] = max(peak_threads[0], threading.active_count())
+
+                    async def fetch_all():
+                        return await asyncio.gather(*(fetch(save_path) for save_path in save_paths), return_exceptions=True)
+                    outcomes = transport.run(fetch_all())
+                elapsed = time.perf_counter() - start
+                size_mb = sum(os.path.getsize(save_path) for save_path in save_paths if os.path.exists(save_path)) / 1024 / 1024
+            errors = [outcome for outcome in outcomes if isinstance(outcome, BaseException)]
+            concurrency = f"{workers} worker threads" if mode == "session" else f"{ASYNC_CONNECTIONS_PER_HOST} requests per host"
+            logger.info(f"[{mode}] {count - len(errors)}/{count} ok in {elapsed:.2f}s: {count / elapsed:.0f} req/s, {size_mb / elapsed:.1f} MB/s "
+                        f"({concurrency}, peak {peak_threads[0]} threads)")
+            if errors:
+                logger.info(f"[{mode}] first error: {str(errors[0])}")
+            downloader.log_connection_stats()
+            if downloader.transport:
+                downloader.transport.stats.clear()
+            results[mode] = (count - len(errors), elapsed, size_mb)
+    finally:
+        downloader.close()
+    return results
+
+def main(argv):
+    parser = argparse.ArgumentParser(prog="get_pixiv", description="Download pixiv artworks without the GUI. Run without arguments to open the GUI.")
+    parser.add_argument("targets", nargs="*", help="user IDs and/or artwork URLs")
+    parser.add_argument("-f", "--file", help="file with one user ID or artwork URL per line")
+    parser.add_argument("-j", "--parallel", type=int, default=1, help="targets processed at the same time (default 1)")
+    parser.add_argument("--workers", type=int, default=DOWNLOAD_WORKERS, help=f"image download workers per target (default {DOWNLOAD_WORKERS})")
+    parser.add_argument("--browsers", type=int, default=BROWSER_INSTANCES, help=f"headless browsers per target (default {BROWSER_INSTANCES})")
+    parser.add_argument("--no-api", action="store_true", help="use the browser instead of the JSON API")
+    parser.add_argument("--full-browser", action="store_true", help="load images and fonts in the browser")
+    parser.add_argument("--sync", action="store_true", help="only download artworks newer than the last complete run")
+    parser.add_argument("--enumerate", action="store_true", help="enumerate all listing pages before downloading")
+    parser.add_argument("--retry-failed", action="store_true", help="only retry the artworks recorded in each user's failed.json")
+    parser.add_argument("--async", dest="async_transfers", action="store_true", help="download images and resolve artworks on the asyncio transport (needs httpx)")
+    parser.add_argument("--http2", action="store_true", help="download images over HTTP/2 on the asyncio transport (needs httpx[http2])")
+    parser.add_argument("--connections", type=int, default=HTTP2_CONNECTIONS, help=f"connections the HTTP/2 client may open (default {HTTP2_CONNECTIONS})")
+    parser.add_argument("--rate-limit", type=float, default=RATE_LIMIT_REQUESTS, metavar="REQ/S",
+                        help="page/image requests per second shared by every instance in this folder (default 0, off)")
+    parser.add_argument("--byte-limit", type=int, default=RATE_LIMIT_BYTES // 1024, metavar="KB/S",
+                        help="download kilobytes per second shared by every instance in this folder (default 0, off)")
+    parser.add_argument("--benchmark-extract", nargs="+", metavar="HTML", help="benchmark the artwork page extractors on saved pages and exit")
+    parser.add_argument("--measure-lean", metavar="URL", help="compare full and lean browser page loads of URL and exit")
+    parser.add_argument("--benchmark-transport", metavar="URL", help="download the image at URL through the session and async transports and exit")
+    parser.add_argument("--benchmark-count", type=int, default=BENCHMARK_REQUESTS, help=f"requests per transport for --benchmark-transport (default {BENCHMARK_REQUESTS})")
+    args = parser.parse_args(argv)
+    if args.benchmark_extract:
+        benchmark_extractors(args.benchmark_extract)
+        return 0
+    if args.benchmark_transport:
+        results = benchmark_transports(args.benchmark_transport, args.benchmark_count, args.workers)
+        return 0 if all(ok == args.benchmark_count for ok, _, _ in results.values()) else 1
+    if args.measure_lean:
+        downloader = PixivDownloader()
+        try:
+            downloader.load_cookie_file()
+            return 0 if downloader.measure_lean_savings(args.measure_lean) else 1
+        finally:
+            downloader.close()
+    return run_batch(args)
 
 if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        sys.exit(main(sys.argv[1:]))
+    if not tk:
+        logger.error("The GUI needs tkinter (python3-tk). Pass user IDs or artwork URLs to run the command-line batch mode.")
+        sys.exit(2)
     root = tk.Tk()
     app = PixivDownloaderApp(root)
     root.mainloop()
\ No newline at end of file
@@ -0,0 +1,93 @@
+import os
+import sys
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import get_pixiv
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+PNG = b"\x89PNG\r\n\x1a\n" + bytes(range(256)) * 64
+
+
+def fixture(name):
+    with open(os.path.join(FIXTURES, name), "rb") as f:
+        return f.read()
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    # Serves the routes registered on the server: path -> (status, content type, body). Image routes honour Range.
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        self.server.requests.append((self.path, dict(self.headers)))
+        status, content_type, body = self.server.routes.get(self.path.split("?")[0], (404, "text/html", b"<html>Not Found</html>"))
+        range_header = self.headers.get("Range")
+        if status == 200 and range_header and self.server.ranges and content_type.startswith("image/"):
+            start = int(range_header.split("=")[1].split("-")[0])
+            self.send_response(206)
+            self.send_header("Content-Range", f"bytes {start}-{len(body) - 1}/{len(body)}")
+            body = body[start:]
+        else:
+            self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class StubServer:
+    def __init__(self):
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+        self.server.routes = {}
+        self.server.requests = []
+        self.server.ranges = True
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def route(self, path, body, status=200, content_type="application/json"):
+        self.server.routes[path] = (status, content_type, body)
+
+    def image(self, path, data=PNG, content_type="image/png"):
+        self.route(path, data, content_type=content_type)
+        return self.url + path
+
+    @property
+    def requests(self):
+        return self.server.requests
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture(autouse=True)
+def workdir(tmp_path, monkeypatch):
+    # get_pixiv keeps its index, caches and rate-limit state in relative paths.
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
+
+
+@pytest.fixture
+def stub():
+    server = StubServer()
+    yield server
+    server.close()
+
+
+@pytest.fixture
+def downloader(stub, tmp_path):
+    engine = get_pixiv.PixivDownloader()
+    engine.rate_limiter.requests_per_sec = 0
+    engine.retry_policy.base_delay = 0.01
+    engine.retry_policy.max_delay = 0.02
+    engine.api.base_url = stub.url
+    engine.save_folder = str(tmp_path / "images")
+    os.makedirs(engine.save_folder)
+    yield engine
+    engine.close()
@@ -0,0 +1,107 @@
+import json
+
+import pytest
+
+import get_pixiv
+from conftest import fixture
+
+
+def test_artwork_ids_are_newest_first_without_duplicates(stub, downloader):
+    stub.route("/ajax/user/42/profile/all", fixture("profile_all.json"))
+    assert downloader.api.get_artwork_ids("42") == ["1005", "120", "98", "77"]
+
+
+def test_user_without_artworks(stub, downloader):
+    stub.route("/ajax/user/42/profile/all", fixture("profile_all_empty.json"))
+    assert downloader.api.get_artwork_ids("42") == []
+
+
+def test_image_urls_are_the_originals_in_page_order(stub, downloader):
+    stub.route("/ajax/illust/1005/pages", fixture("illust_pages.json"))
+    assert downloader.api.get_image_urls("1005") == [
+        "https://i.pximg.net/img-original/img/2024/01/02/03/04/05/1005_p0.png",
+        "https://i.pximg.net/img-original/img/2024/01/02/03/04/05/1005_p1.jpg",
+    ]
+
+
+def test_error_body_raises_with_the_api_message(stub, downloader):
+    stub.route("/ajax/illust/7/pages", fixture("illust_deleted.json"))
+    with pytest.raises(ValueError, match="deleted"):
+        downloader.api.get_image_urls("7")
+    assert len(stub.requests) == 1
+
+
+def test_http_errors_are_retried(stub, downloader):
+    stub.route("/ajax/illust/7/pages", b"", status=503)
+    with pytest.raises(get_pixiv.requests.HTTPError):
+        downloader.api.get_image_urls("7")
+    assert len(stub.requests) == downloader.retry_policy.attempts
+
+
+class RecordingPool:
+    def __init__(self):
+        self.submitted = []
+
+    def submit(self, artwork_url, page_num, image_urls):
+        self.submitted.append((artwork_url, image_urls))
+
+    def skip(self, artwork_url, page_num):
+        self.submitted.append((artwork_url, None))
+
+
+def test_browser_fallback_when_the_api_fails(stub, downloader, monkeypatch):
+    stub.route("/ajax/illust/1005/pages", fixture("illust_pages.json"))
+    stub.route("/ajax/illust/7/pages", fixture("illust_deleted.json"))
+    browser_urls = ["https://i.pximg.net/img-original/img/2024/01/02/03/04/05/7_p0.png"]
+    resolved_by_browser = []
+
+    def resolve_with_browser(artwork_url, session_valid):
+        resolved_by_browser.append(artwork_url)
+        return browser_urls
+
+    monkeypatch.setattr(downloader, "resolve_with_browser", resolve_with_browser)
+    pool = RecordingPool()
+    failed_urls = []
+    artwork_urls = ["https://www.pixiv.net/en/artworks/1005", "https://www.pixiv.net/en/artworks/7"]
+    downloader.queue_artworks(artwork_urls, 1, pool, [True], failed_urls)
+    assert resolved_by_browser == ["https://www.pixiv.net/en/artworks/7"]
+    assert dict(pool.submitted)["https://www.pixiv.net/en/artworks/7"] == browser_urls
+    assert len(dict(pool.submitted)["https://www.pixiv.net/en/artworks/1005"]) == 2
+    assert failed_urls == []
+    assert downloader.resolve("https://www.pixiv.net/en/artworks/7") == browser_urls
+
+
+def test_resolve_after_a_cancelled_run_uses_a_fresh_token(stub, downloader):
+    stub.route("/ajax/illust/1005/pages", fixture("illust_pages.json"))
+    downloader.token.cancel()
+    assert len(downloader.resolve("https://www.pixiv.net/en/artworks/1005")) == 2
+    token = get_pixiv.CancelToken()
+    assert len(downloader.resolve("https://www.pixiv.net/en/artworks/1005", token=token)) == 2
+    assert downloader.token is token
+
+
+def test_enumerate_user_does_not_reuse_the_previous_users_ids(stub, downloader):
+    stub.route("/ajax/user/42/profile/all", fixture("profile_all.json"))
+    stub.route("/ajax/user/43/profile/all", json.dumps({"error": False, "body": {"illusts": {"300": None, "200": None}, "manga": []}}).encode())
+    downloader.cookies_valid = True
+    assert downloader.enumerate_user("42") == ["1005", "120", "98", "77"]
+    # A cache entry without ids, as the browser path writes it, must not pick up user 42's list.
+    downloader.listing_cache.put("43", 2, 48, pages={1: ["300", "200"]})
+    assert downloader.enumerate_user("43") == ["300", "200"]
+
+
+def test_artwork_events_report_failed_artworks(stub, downloader):
+    stub.route("/ajax/user/42/profile/all", fixture("profile_all.json"))
+    for artwork_id in ("1005", "120", "98", "77"):
+        image_url = f"{stub.url}/img/{artwork_id}_p0.png"
+        if artwork_id != "77":
+            stub.image(f"/img/{artwork_id}_p0.png")
+        stub.route(f"/ajax/illust/{artwork_id}/pages", json.dumps({"error": False, "body": [{"urls": {"original": image_url}}]}).encode())
+    events = []
+    downloader.subscribe(events.append)
+    downloader.cookies_valid = True
+
+    assert not downloader.download("42")
+    statuses = {event["artwork_url"].split("/")[-1]: event["status"] for event in events if event["event"] == "artwork"}
+    assert statuses == {"1005": "downloaded", "120": "downloaded", "98": "downloaded", "77": "failed"}
+    assert (downloader.processed_count, downloader.downloaded_count, downloader.failed_count) == (4, 3, 1)
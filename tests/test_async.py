@@ -0,0 +1,56 @@
+import asyncio
+import os
+import threading
+
+import pytest
+
+import get_pixiv
+from conftest import PNG
+
+pytest.importorskip("httpx")
+
+
+def test_controller_wakes_async_waiters_on_release():
+    controller = get_pixiv.ConcurrencyController(1, min_limit=1)
+
+    async def contend():
+        await controller.acquire_async()
+        waiting = asyncio.ensure_future(controller.acquire_async())
+        await asyncio.sleep(0.05)
+        assert not waiting.done()
+        threading.Timer(0.05, controller.release).start()
+        await asyncio.wait_for(waiting, 1)
+        return controller.in_flight
+
+    assert asyncio.run(contend()) == 1
+
+
+def test_async_download_keeps_blocking_work_off_the_loop(stub, downloader, monkeypatch):
+    downloader.async_var.set(True)
+    transport = downloader.get_transport()
+    downloader.reset_run_state()
+    calls = {}
+    for name in ("find_existing_image", "finish_part"):
+        original = getattr(downloader, name)
+        monkeypatch.setattr(downloader, name, lambda *args, name=name, original=original: calls.setdefault(name, threading.current_thread()) and original(*args))
+    mark_complete = downloader.index.mark_complete
+    monkeypatch.setattr(downloader.index, "mark_complete", lambda *args: calls.setdefault("mark_complete", threading.current_thread()) and mark_complete(*args))
+
+    assert transport.run(downloader.download_image_async(stub.image("/img/1_p0.png"))) == "downloaded"
+    with open(os.path.join(downloader.save_folder, "1_p0.png"), "rb") as f:
+        assert f.read() == PNG
+    assert set(calls) == {"find_existing_image", "finish_part", "mark_complete"}
+    assert transport.thread not in calls.values()
+
+
+def test_artwork_accounting_runs_off_the_loop(stub, downloader):
+    downloader.async_var.set(True)
+    transport = downloader.get_transport()
+    done = []
+    pool = get_pixiv.AsyncDownloadPool(transport, downloader.download_image_async,
+                                       lambda artwork_url, page_num, statuses: done.append((threading.current_thread(), statuses)))
+    downloader.reset_run_state()
+    pool.submit("https://www.pixiv.net/en/artworks/1", 1, [stub.image("/img/1_p0.png"), stub.image("/img/1_p1.png")])
+    pool.close()
+    assert [statuses for _, statuses in done] == [["downloaded", "downloaded"]]
+    assert done[0][0] is not transport.thread
@@ -0,0 +1,14 @@
+import os
+import subprocess
+import sys
+
+PACKAGE = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_batch_mode_runs_without_tkinter(tmp_path):
+    # sys.modules["tkinter"] = None makes the import fail as it does on images without python3-tk.
+    script = "import sys; sys.modules['tkinter'] = None; import get_pixiv; sys.exit(get_pixiv.main([]))"
+    result = subprocess.run([sys.executable, "-c", script], cwd=tmp_path, env=dict(os.environ, PYTHONPATH=PACKAGE),
+                            capture_output=True, text=True, timeout=60)
+    assert result.returncode == 2, result.stderr
+    assert "No user IDs or artwork URLs given." in result.stdout + result.stderr
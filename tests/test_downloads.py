@@ -0,0 +1,80 @@
+import collections
+import os
+import types
+
+import pytest
+
+from conftest import PNG, StubHandler
+
+
+def test_stream_to_file_writes_the_image_atomically(stub, downloader):
+    url = stub.image("/img/1_p0.png")
+    save_path = os.path.join(downloader.save_folder, "1_p0.png")
+    assert downloader.stream_to_file(url, save_path)
+    with open(save_path, "rb") as f:
+        assert f.read() == PNG
+    assert not os.path.exists(save_path + ".part")
+
+
+def test_partial_file_is_resumed_with_a_range_request(stub, downloader):
+    url = stub.image("/img/1_p0.png")
+    save_path = os.path.join(downloader.save_folder, "1_p0.png")
+    with open(save_path + ".part", "wb") as f:
+        f.write(PNG[:1000])
+    assert downloader.stream_to_file(url, save_path)
+    with open(save_path, "rb") as f:
+        assert f.read() == PNG
+    assert stub.requests[-1][1].get("Range") == "bytes=1000-"
+
+
+def test_partial_file_is_replaced_when_the_server_ignores_range(stub, downloader):
+    stub.server.ranges = False
+    url = stub.image("/img/1_p0.png")
+    save_path = os.path.join(downloader.save_folder, "1_p0.png")
+    with open(save_path + ".part", "wb") as f:
+        f.write(b"stale bytes")
+    assert downloader.stream_to_file(url, save_path)
+    with open(save_path, "rb") as f:
+        assert f.read() == PNG
+
+
+def test_html_error_page_is_not_saved(stub, downloader):
+    stub.route("/img/1_p0.png", b"<html>rate limited</html>", content_type="text/html")
+    save_path = os.path.join(downloader.save_folder, "1_p0.png")
+    with pytest.raises(ValueError, match="text/html"):
+        downloader.stream_to_file(stub.url + "/img/1_p0.png", save_path)
+    assert not os.path.exists(save_path)
+
+
+def test_body_that_is_not_an_image_is_discarded(stub, downloader):
+    url = stub.image("/img/1_p0.png", data=b"<html>" + bytes(100))
+    save_path = os.path.join(downloader.save_folder, "1_p0.png")
+    with pytest.raises(ValueError, match="not a PNG"):
+        downloader.stream_to_file(url, save_path)
+    assert not os.path.exists(save_path)
+    assert not os.path.exists(save_path + ".part")
+
+
+def test_download_image_probes_the_other_extensions(stub, downloader):
+    stub.image("/img/1_p0.jpg", data=b"\xff\xd8\xff" + bytes(500), content_type="image/jpeg")
+    assert downloader.download_image(stub.url + "/img/1_p0.png") == "downloaded"
+    assert os.path.exists(os.path.join(downloader.save_folder, "1_p0.jpg"))
+    assert downloader.download_image(stub.url + "/img/1_p0.png") == "skipped"
+
+
+@pytest.mark.parametrize("protocol, connections", [("HTTP/1.1", 1), ("HTTP/1.0", 3)])
+def test_session_counts_real_connects(stub, downloader, monkeypatch, protocol, connections):
+    monkeypatch.setattr(StubHandler, "protocol_version", protocol)
+    downloader.reset_run_state()
+    for page in range(3):
+        url = stub.image(f"/img/1_p{page}.png")
+        assert downloader.stream_to_file(url, os.path.join(downloader.save_folder, f"1_p{page}.png"))
+    assert downloader.session_connection_stats() == (3, connections, 0)
+
+
+def test_connection_summary_names_every_http_version(downloader, caplog):
+    downloader.transport = types.SimpleNamespace(stats=collections.Counter({"requests": 3, "connections": 3, "HTTP/1.0": 2, "HTTP/1.1": 1}))
+    with caplog.at_level("INFO"):
+        downloader.log_connection_stats()
+    downloader.transport = None
+    assert "3 requests (1 HTTP/1.1, 2 HTTP/1.0) over 3 new connections" in caplog.text
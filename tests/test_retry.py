@@ -0,0 +1,92 @@
+import time
+
+import pytest
+
+import get_pixiv
+
+
+class Flaky:
+    def __init__(self, failures, error=OSError("connection reset")):
+        self.failures = failures
+        self.error = error
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        if self.calls <= self.failures:
+            raise self.error
+        return "ok"
+
+
+def test_backoff_is_capped_exponential_with_full_jitter(monkeypatch):
+    policy = get_pixiv.RetryPolicy(base_delay=1.0, max_delay=5.0)
+    monkeypatch.setattr(get_pixiv.random, "uniform", lambda low, high: high)
+    assert [policy.backoff(attempt) for attempt in range(1, 6)] == [1.0, 2.0, 4.0, 5.0, 5.0]
+    monkeypatch.setattr(get_pixiv.random, "uniform", lambda low, high: low)
+    assert policy.backoff(4) == 0
+
+
+def test_retries_until_success():
+    policy = get_pixiv.RetryPolicy(attempts=4, base_delay=0.001)
+    attempt = Flaky(2)
+    assert policy.call(attempt, "test") == "ok"
+    assert attempt.calls == 3
+    assert (policy.requests, policy.retries) == (3, 2)
+
+
+def test_client_errors_are_not_retried():
+    response = get_pixiv.requests.Response()
+    response.status_code = 404
+    policy = get_pixiv.RetryPolicy(base_delay=0.001)
+    attempt = Flaky(5, get_pixiv.requests.HTTPError("HTTP 404", response=response))
+    with pytest.raises(get_pixiv.requests.HTTPError):
+        policy.call(attempt, "test", retry_on=(get_pixiv.requests.RequestException,))
+    assert attempt.calls == 1
+
+
+def test_retry_budget_fails_fast_once_spent():
+    policy = get_pixiv.RetryPolicy(attempts=5, base_delay=0.001, budget_ratio=0.0, budget_min=3)
+    attempt = Flaky(100)
+    with pytest.raises(OSError):
+        policy.call(attempt, "test")
+    assert attempt.calls == 4
+    assert policy.retries == 3
+    assert policy.budget_exhausted
+    attempt = Flaky(100)
+    with pytest.raises(OSError):
+        policy.call(attempt, "test")
+    assert attempt.calls == 1
+
+
+def test_breaker_trips_and_cools_down(monkeypatch):
+    monkeypatch.setattr(get_pixiv, "BREAKER_COOLDOWN", 0.3)
+    policy = get_pixiv.RetryPolicy()
+    for n in range(get_pixiv.BREAKER_WINDOW):
+        policy.record(n % 2 == 0)
+    assert policy.trips == 1
+    assert 0 < policy.closed_in() <= 0.3
+
+    started = time.time()
+    assert policy.call(lambda: "ok", "test") == "ok"
+    assert time.time() - started >= 0.2
+    assert policy.closed_in() == 0
+
+
+def test_stop_interrupts_an_open_breaker(monkeypatch):
+    monkeypatch.setattr(get_pixiv, "BREAKER_COOLDOWN", 30.0)
+    policy = get_pixiv.RetryPolicy()
+    for _ in range(get_pixiv.BREAKER_WINDOW):
+        policy.record(False)
+    started = time.time()
+    with pytest.raises(OSError):
+        policy.call(Flaky(1), "test", should_stop=lambda: True)
+    assert time.time() - started < 1
+
+
+def test_sleep_survives_the_deadline_passing_between_clock_reads(monkeypatch):
+    clock = iter([100.0, 100.5, 101.0])
+    monkeypatch.setattr(get_pixiv.time, "time", lambda: next(clock))
+    slept = []
+    monkeypatch.setattr(get_pixiv.time, "sleep", lambda seconds: slept.append(seconds) if seconds >= 0 else pytest.fail("negative sleep"))
+    assert get_pixiv.RetryPolicy.sleep(0.6, lambda: False)
+    assert all(seconds >= 0 for seconds in slept)
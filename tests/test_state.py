@@ -0,0 +1,140 @@
+import json
+import multiprocessing
+import os
+
+import get_pixiv
+from conftest import fixture
+
+
+def test_checkpoint_round_trip(tmp_path):
+    params = {"user_id": "42", "sync": False, "browserless": True, "enumerate": False}
+    checkpoint = get_pixiv.Checkpoint(str(tmp_path), params)
+    assert not checkpoint.resumed
+    checkpoint.start(2, ["3", "2", "1"])
+    checkpoint.record_page(1, ["3", "2"])
+    checkpoint.mark_done("3")
+    checkpoint.save()
+
+    resumed = get_pixiv.Checkpoint(str(tmp_path), params)
+    assert resumed.resumed
+    assert resumed.done == {"3"}
+    assert resumed.page(1) == ["3", "2"]
+    assert resumed.page(2) is None
+    assert resumed.data["work_ids"] == ["3", "2", "1"]
+
+    resumed.clear()
+    resumed.save()
+    assert not os.path.exists(resumed.path)
+
+
+def test_checkpoint_of_another_job_is_ignored(tmp_path):
+    get_pixiv.Checkpoint(str(tmp_path), {"user_id": "42", "sync": False}).start(1)
+    assert not get_pixiv.Checkpoint(str(tmp_path), {"user_id": "42", "sync": True}).resumed
+
+
+def test_failure_log_round_trip(tmp_path):
+    failure_log = get_pixiv.FailureLog(str(tmp_path))
+    failure_log.update([("https://www.pixiv.net/en/artworks/1", 1, "Failed to extract image URLs")],
+                       [("https://i.pximg.net/2_p0.png", "https://www.pixiv.net/en/artworks/2", 1, "HTTP 404")], set())
+    with open(failure_log.path) as f:
+        assert [entry["artwork_url"] for entry in json.load(f)] == ["https://www.pixiv.net/en/artworks/1", "https://www.pixiv.net/en/artworks/2"]
+
+    reloaded = get_pixiv.FailureLog(str(tmp_path))
+    reloaded.update([("https://www.pixiv.net/en/artworks/1", 1, "Failed to extract image URLs")], [], {"https://www.pixiv.net/en/artworks/2"})
+    entry = reloaded.entries["https://www.pixiv.net/en/artworks/1"]
+    assert entry["attempts"] == 2
+    assert entry["first_failed"] <= entry["last_failed"]
+    assert "https://www.pixiv.net/en/artworks/2" not in get_pixiv.FailureLog(str(tmp_path)).entries
+
+    reloaded.update([], [], {"https://www.pixiv.net/en/artworks/1"})
+    assert not os.path.exists(reloaded.path)
+
+
+def test_resumed_run_counts_artworks_done_before_the_checkpoint(stub, downloader):
+    stub.route("/ajax/user/42/profile/all", fixture("profile_all.json"))
+    for artwork_id in ("1005", "120", "98", "77"):
+        image_url = stub.image(f"/img/{artwork_id}_p0.png")
+        stub.route(f"/ajax/illust/{artwork_id}/pages", json.dumps({"error": False, "body": [{"urls": {"original": image_url}}]}).encode())
+    folder = os.path.join(get_pixiv.save_folder_base, "pixiv_42_images")
+    os.makedirs(folder)
+    checkpoint = get_pixiv.Checkpoint(folder, {"user_id": "42", "sync": False, "browserless": True, "enumerate": False})
+    checkpoint.start(1, ["1005", "120", "98", "77"])
+    checkpoint.mark_done("1005")
+    checkpoint.save()
+    events = []
+    downloader.subscribe(events.append)
+    downloader.cookies_valid = True
+
+    assert downloader.download("42")
+    assert downloader.processed_count == 4
+    assert downloader.skipped_count == 1
+    assert [event["percent"] for event in events if event["event"] == "artwork"][-1] == 100
+    assert not os.path.exists(os.path.join(folder, "1005_p0.png"))
+
+
+def test_rebuild_does_not_trust_folders_as_complete(tmp_path):
+    folder = tmp_path / "pixiv_images" / "someone"
+    folder.mkdir(parents=True)
+    (folder / "101_p0.png").write_bytes(b"\x89PNG\r\n\x1a\n" + bytes(10))
+    (folder / "102_p0.png").write_bytes(b"\x89PNG\r\n\x1a\n" + bytes(10))
+    (folder / "102_p1.png").write_bytes(b"\x89PNG\r\n\x1a\n" + bytes(10))
+    index = get_pixiv.DownloadIndex(str(tmp_path / "index.db"))
+    try:
+        assert index.rebuild(str(tmp_path / "pixiv_images")) == 2
+        # Artwork 101 really has two pages; only p0 made it to disk.
+        assert not index.is_complete("101")
+        index.record_urls("101", ["https://i.pximg.net/101_p0.png", "https://i.pximg.net/101_p1.png"])
+        assert not index.is_complete("101", str(folder))
+        index.record_urls("102", ["https://i.pximg.net/102_p0.png", "https://i.pximg.net/102_p1.png"])
+        assert index.is_complete("102", str(folder))
+    finally:
+        index.close()
+
+
+def _fill_listing_cache(path, worker):
+    cache = get_pixiv.ListingCache(path)
+    for n in range(20):
+        cache.put(f"{worker}-{n}", 48, 48, {1: [str(n)]})
+
+
+def test_listing_cache_merges_concurrent_writers(tmp_path):
+    path = str(tmp_path / "listing_cache.json")
+    processes = [multiprocessing.Process(target=_fill_listing_cache, args=(path, worker)) for worker in range(4)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+    assert [process.exitcode for process in processes] == [0, 0, 0, 0]
+    with open(path) as f:
+        assert len(json.load(f)) == 80
+    assert not [name for name in os.listdir(tmp_path) if name.endswith(".tmp")]
+
+    cache = get_pixiv.ListingCache(path)
+    cache.invalidate("0-0")
+    cache.set_page("0-1", 2, ["9"])
+    reloaded = get_pixiv.ListingCache(path)
+    assert reloaded.get("0-0") is None
+    assert reloaded.page("0-1", 2) == ["9"]
+
+
+def test_stop_is_not_recorded_as_a_failure(downloader):
+    downloader.completed_urls = set()
+    downloader.token = get_pixiv.CancelToken()
+    downloader.token.cancel()
+    failed_urls = [("https://www.pixiv.net/en/artworks/1", 1, "Session interrupted"),
+                   ("https://www.pixiv.net/en/artworks/2", 1, "Failed to extract image URLs")]
+    downloader.log_failures(failed_urls, [])
+    assert downloader.failed_count == 1
+    assert list(get_pixiv.FailureLog(downloader.save_folder).entries) == ["https://www.pixiv.net/en/artworks/2"]
+
+
+def test_failure_log_keeps_listing_pages_out(tmp_path):
+    listing_url = "https://www.pixiv.net/en/users/42/artworks?p=3"
+    failure_log = get_pixiv.FailureLog(str(tmp_path))
+    failure_log.update([(listing_url, 3, "Failed to enumerate listing page"),
+                        ("https://www.pixiv.net/en/artworks/5", 3, "Failed to extract image URLs")], [], set())
+    assert list(get_pixiv.FailureLog(str(tmp_path)).entries) == ["https://www.pixiv.net/en/artworks/5"]
+
+    with open(failure_log.path, "w") as f:
+        json.dump([{"artwork_url": listing_url, "page": 3, "attempts": 1}], f)
+    assert get_pixiv.FailureLog(str(tmp_path)).entries == {}
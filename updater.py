@@ -3,6 +3,7 @@ import os
 import requests
 import tkinter as tk
 import logging
+import logging.handlers
 import time
 import webbrowser
 import subprocess
@@ -10,7 +11,7 @@ import subprocess
 logging.basicConfig(
     level=logging.INFO,
     format='%(message)s',
-    handlers=[logging.FileHandler("output.log", mode='a'), logging.StreamHandler(sys.stdout)]
+    handlers=[logging.handlers.RotatingFileHandler("output.log", maxBytes=5 * 1024 * 1024, backupCount=3), logging.StreamHandler(sys.stdout)]
 )
 logger = logging.getLogger()
 